@@ -1,13 +1,166 @@
 import logging
+import re
+import subprocess
+from collections import namedtuple
+from dataclasses import asdict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from pydub import AudioSegment
-from faster_whisper import WhisperModel
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from faster_whisper.audio import decode_audio as whisper_decode_audio
+from faster_whisper.vad import SpeechTimestampsMap, VadOptions, collect_chunks, get_speech_timestamps, merge_segments
+from config import (ASR_LONG_AUDIO_CHUNK_SECONDS, ASR_LONG_AUDIO_OVERLAP_SECONDS, ASR_LONG_AUDIO_SECONDS,
+                    ASR_LONG_AUDIO_WORKERS, MODEL_STORE_DIR, MODEL_STORE_OFFLINE, TRANSCRIPT_CACHE_DIR, TRANSCRIPT_CACHE_MAX_MB, VAD_MIN_SILENCE_MS,
+                    VAD_MIN_SPEECH_MS, VAD_SPEECH_PAD_MS, VAD_THRESHOLD)
 from logger import setup_logger
+import metrics
+from model_store import ModelStoreError, resolve as resolve_stored_model
+from transcript_cache import TranscriptCache
 import os
 
 setup_logger()
 logger = logging.getLogger(__name__)
 
+# Реестр загруженных моделей: одна модель на процесс для каждого набора параметров
+_models = {}
+_model_stats = {}
+_models_lock = threading.Lock()
+
+SAMPLE_RATE = 16000
+
+# Метрики распознавания по режиму: stream, cascade_draft, cascade_full, batch
+ASR_AUDIO_SECONDS = metrics.histogram("gse_asr_audio_seconds", "Длительность распознанного аудио, с", ("mode",),
+                                      buckets=(5, 10, 20, 30, 60, 120, 300, 600, 1800))
+ASR_DECODE_SECONDS = metrics.histogram("gse_asr_decode_seconds", "Время распознавания файла, с", ("mode",))
+ASR_REAL_TIME_FACTOR = metrics.histogram("gse_asr_real_time_factor", "Время распознавания / длительность аудио",
+                                         ("mode",), buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5))
+ASR_CACHE_HITS = metrics.counter("gse_asr_cache_hits_total", "Тексты, взятые из кэша распознавания", ("mode",))
+
+# Сегмент распознанного текста; время – в секундах исходного файла (с учётом вырезанной тишины)
+TranscriptSegment = namedtuple(
+    "TranscriptSegment", ["start", "end", "text", "avg_logprob", "no_speech_prob", "compression_ratio"]
+)
+
+
+_transcript_cache = None
+
+
+def get_transcript_cache():
+    """Общий кэш распознанных текстов; ``None``, если кэш отключён (TRANSCRIPT_CACHE_MAX_MB = 0)."""
+    global _transcript_cache
+    if _transcript_cache is None and TRANSCRIPT_CACHE_MAX_MB > 0:
+        _transcript_cache = TranscriptCache(TRANSCRIPT_CACHE_DIR, TRANSCRIPT_CACHE_MAX_MB * 1024 * 1024)
+    return _transcript_cache
+
+
+def _cache_key(file_path: str, mode: str, beam_size: int = 5, **settings):
+    cache = get_transcript_cache()
+    if cache is None:
+        return None
+    return cache.make_key(file_path, mode=mode, vad=asdict(vad_options()), beam_size=beam_size, **settings)
+
+
+def _model_key(model_path: str, device: str, compute_type: str, cpu_threads: int, num_workers: int = 1) -> tuple:
+    return model_path, device, compute_type, int(cpu_threads or 0), int(num_workers or 1)
+
+
+def resolve_model_path(model_path: str):
+    """Где брать модель: каталог, текущая версия из локального хранилища или (если разрешено) Hugging Face.
+
+    Возвращает путь и признак того, что модель локальная и загружается без обращения к сети.
+    """
+    if os.path.isdir(model_path):
+        return model_path, True
+    stored = resolve_stored_model(model_path)
+    if stored:
+        return stored, True
+    if MODEL_STORE_OFFLINE:
+        raise ModelStoreError(f"Модели {model_path} нет в {MODEL_STORE_DIR}, "
+                              f"выполните: python model_store.py fetch {model_path}")
+    logger.warning(f"Модели {model_path} нет в локальном хранилище, она будет загружена из сети")
+    return model_path, False
+
+
+def get_model(model_path: str, device: str = "cpu", compute_type: str = "int8",
+              cpu_threads: int = 0, num_workers: int = 1) -> WhisperModel:
+    """Возвращает загруженную модель Whisper, загружая её только при первом обращении.
+
+    ``num_workers`` > 1 позволяет вызывать ``transcribe`` из нескольких потоков параллельно.
+    """
+    key = _model_key(model_path, device, compute_type, cpu_threads, num_workers)
+    with _models_lock:
+        model = _models.get(key)
+        if model is not None:
+            _model_stats[key]["hits"] += 1
+            return model
+
+        logger.info(f"Загружаем модель Whisper {model_path} ({device}, {compute_type}, потоков: {cpu_threads or 'auto'})...")
+        started = time.perf_counter()
+        path, local = resolve_model_path(model_path)
+        model = WhisperModel(path, device=device, compute_type=compute_type, cpu_threads=int(cpu_threads or 0),
+                             num_workers=int(num_workers or 1), local_files_only=local)
+        load_seconds = time.perf_counter() - started
+        logger.info(f"Модель Whisper загружена за {load_seconds:.1f} с")
+
+        _models[key] = model
+        _model_stats[key] = {"load_seconds": load_seconds, "loaded_at": time.time(), "hits": 0}
+        return model
+
+
+def stream_layout(cpu_threads: int = 0, replicas: int = None, long_audio: bool = False) -> tuple:
+    """Потоков на реплику и число реплик модели для ``transcribe_stream``.
+
+    С явным ``replicas`` (раскладка autotune; пул процессов передаёт 1) все записи распознаются одной
+    моделью, бюджет ``cpu_threads`` делится между её репликами. Без него короткая запись распознаётся
+    одной репликой на весь бюджет, а части длинной (``long_audio``) – ASR_LONG_AUDIO_WORKERS
+    репликами по своей доле потоков; такая модель загружается при первой длинной записи.
+    """
+    if not replicas:
+        replicas = ASR_LONG_AUDIO_WORKERS if long_audio else 1
+    replicas = max(1, replicas)
+    if replicas == 1:
+        return cpu_threads, 1
+    return max(1, (cpu_threads or os.cpu_count() or replicas) // replicas), replicas
+
+
+def warmup(model_path: str, device: str = "cpu", compute_type: str = "int8", cpu_threads: int = 0,
+           num_workers: int = 1) -> WhisperModel:
+    """Загружает модель и прогоняет через неё секунду тишины, чтобы первый файл не платил за инициализацию."""
+    model = get_model(model_path, device, compute_type, cpu_threads, num_workers)
+    started = time.perf_counter()
+    segments, _ = model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), beam_size=1, language="ru")
+    list(segments)
+    key = _model_key(model_path, device, compute_type, cpu_threads, num_workers)
+    with _models_lock:
+        if key in _model_stats:
+            _model_stats[key]["warmup_seconds"] = time.perf_counter() - started
+    return model
+
+
+def evict(model_path: str = None, device: str = None, compute_type: str = None, cpu_threads: int = None) -> int:
+    """Выгружает модели, подходящие под переданные параметры (без параметров – все). Возвращает число выгруженных."""
+    with _models_lock:
+        keys = [key for key in _models
+                if (model_path is None or key[0] == model_path)
+                and (device is None or key[1] == device)
+                and (compute_type is None or key[2] == compute_type)
+                and (cpu_threads is None or key[3] == int(cpu_threads))]
+        for key in keys:
+            del _models[key]
+            _model_stats.pop(key, None)
+            logger.info(f"Модель Whisper {key[0]} ({key[1]}, {key[2]}) выгружена")
+    return len(keys)
+
+
+def get_model_stats() -> dict:
+    """Метрики загрузки моделей: время загрузки, прогрева и число повторных использований."""
+    with _models_lock:
+        return {"/".join(map(str, key)): dict(stats) for key, stats in _model_stats.items()}
+
+
 def convert_to_16k_mono(input_path: str, output_path: str = None) -> str:
     if not os.path.exists(input_path):
         logger.error(f"Файл {input_path} не найден")
@@ -24,14 +177,383 @@ def convert_to_16k_mono(input_path: str, output_path: str = None) -> str:
     return output_path
 
 
-def transcribe_audio(file_path: str, model_path: str, device: str = "cpu", compute_type: str = "float16") -> str:
+def decode_audio(input_path: str, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Декодирует файл через ffmpeg прямо в память: float32, моно, ``sampling_rate`` Гц."""
+    if not os.path.exists(input_path):
+        logger.error(f"Файл {input_path} не найден")
+        raise FileNotFoundError(f"Файл {input_path} не найден")
+
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0",
+        "-i", input_path,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sampling_rate),
+        "-",
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+def load_audio(file_path: str) -> np.ndarray:
+    """Возвращает аудио для ``model.transcribe``: float32, моно, 16 кГц.
+
+    Основной путь – декодирование в память; при отсутствии ffmpeg или ошибке декодирования
+    используется старая конвертация через pydub во временный ``_converted.wav``, который сразу удаляется.
+    """
+    try:
+        return decode_audio(file_path)
+    except FileNotFoundError:
+        if not os.path.exists(file_path):
+            raise
+        logger.warning("ffmpeg не найден, используем конвертацию через файл")
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"Ошибка декодирования {file_path} в память: {e.stderr.decode(errors='ignore').strip()}, "
+                       f"используем конвертацию через файл")
     converted_file = convert_to_16k_mono(file_path)
+    try:
+        return whisper_decode_audio(converted_file, sampling_rate=SAMPLE_RATE)
+    finally:
+        _remove_temp_file(converted_file)
+
+
+def _remove_temp_file(path: str):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"Не удалось удалить временный файл {path}: {e}")
+
+
+def vad_options(**overrides) -> VadOptions:
+    """Параметры VAD из конфига; ``overrides`` позволяют поменять отдельные поля."""
+    options = {
+        "threshold": VAD_THRESHOLD,
+        "min_speech_duration_ms": VAD_MIN_SPEECH_MS,
+        "min_silence_duration_ms": VAD_MIN_SILENCE_MS,
+        "speech_pad_ms": VAD_SPEECH_PAD_MS,
+    }
+    options.update(overrides)
+    return VadOptions(**options)
+
+
+def detect_speech(audio: np.ndarray, options: VadOptions = None, label: str = "") -> list:
+    """Находит фрагменты речи (в сэмплах) и логирует, сколько аудио будет отброшено."""
+    chunks = get_speech_timestamps(audio, options or vad_options())
+    total = len(audio) / SAMPLE_RATE
+    speech = sum(chunk["end"] - chunk["start"] for chunk in chunks) / SAMPLE_RATE
+    dropped = total - speech
+    logger.info(f"VAD {label}: речь {speech:.1f} с из {total:.1f} с, отброшено {dropped:.1f} с "
+                f"({dropped / total * 100 if total else 0:.0f}%)")
+    return chunks
+
+
+def trim_non_speech(audio: np.ndarray, options: VadOptions = None, label: str = ""):
+    """Вырезает тишину, гудки и шум. Возвращает склеенную речь и фрагменты в исходных сэмплах."""
+    chunks = detect_speech(audio, options, label)
+    if not chunks:
+        return np.array([], dtype=np.float32), []
+    speech_chunks, _ = collect_chunks(audio, chunks)
+    return np.concatenate(speech_chunks), chunks
+
+
+def _observe(mode: str, audio_seconds: float, seconds: float):
+    ASR_AUDIO_SECONDS.observe(audio_seconds, mode=mode)
+    ASR_DECODE_SECONDS.observe(seconds, mode=mode)
+    if audio_seconds:
+        ASR_REAL_TIME_FACTOR.observe(seconds / audio_seconds, mode=mode)
 
-    logger.info("Загружаем модель Whisper...")
-    model = WhisperModel(model_path, device=device, compute_type=compute_type)
-    segments, info = model.transcribe(converted_file, beam_size=5, language="ru")
+
+def _prepare_speech(file_path: str):
+    """Декодирует файл и находит в нём речь. Возвращает исходное аудио и фрагменты речи в сэмплах."""
+    audio = load_audio(file_path)
+    chunks = detect_speech(audio, label=os.path.basename(file_path))
+    if not chunks:
+        logger.warning(f"В {file_path} речь не обнаружена, распознавание пропущено")
+    return audio, chunks
+
+
+def _decode_segments(model: WhisperModel, audio: np.ndarray, chunks: list, beam_size: int = 5):
+    """Распознаёт только фрагменты речи ``chunks`` из ``audio``; время сегментов – в секундах исходного аудио."""
+    speech, _ = collect_chunks(audio, chunks)
+    segments, info = model.transcribe(np.concatenate(speech), beam_size=beam_size, language="ru",
+                                      vad_filter=False)
     logger.info(f"Обнаружен язык: {info.language}, уверенность: {info.language_probability:.2f}")
 
+    timestamps = SpeechTimestampsMap(chunks, SAMPLE_RATE)
+    for segment in segments:
+        yield TranscriptSegment(
+            start=timestamps.get_original_time(segment.start),
+            end=timestamps.get_original_time(segment.end),
+            text=segment.text.strip(),
+            avg_logprob=segment.avg_logprob,
+            no_speech_prob=segment.no_speech_prob,
+            compression_ratio=segment.compression_ratio,
+        )
+
+
+def split_long_speech(chunks: list, max_seconds: float, overlap_seconds: float) -> list:
+    """Делит фрагменты речи на группы не длиннее ``max_seconds`` для параллельного распознавания.
+
+    Границы групп проходят по паузам, найденным VAD. Непрерывная речь длиннее ``max_seconds``
+    режется принудительно с перекрытием ``overlap_seconds``, повторы потом убирает ``_stitch``.
+    """
+    max_samples = int(max_seconds * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+
+    pieces = []
+    for chunk in chunks:
+        start = chunk["start"]
+        while chunk["end"] - start > max_samples:
+            pieces.append({"start": start, "end": start + max_samples})
+            start += max_samples - overlap
+        pieces.append({"start": start, "end": chunk["end"]})
+
+    groups, current = [], []
+    for piece in pieces:
+        if current and piece["end"] - current[0]["start"] > max_samples:
+            groups.append(current)
+            current = []
+        current.append(piece)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _words(text: str) -> list:
+    return [re.sub(r"[^\w]", "", word.lower()) for word in text.split()]
+
+
+def _stitch(previous: list, segments: list, max_overlap_words: int = 8) -> list:
+    """Убирает из начала ``segments`` слова, повторяющие конец ``previous`` (след перекрытия групп)."""
+    if not previous or not segments:
+        return segments
+    tail = _words(" ".join(segment.text for segment in previous[-2:]))
+    head_words = segments[0].text.split()
+    head = _words(segments[0].text)
+    for size in range(min(max_overlap_words, len(tail), len(head)), 0, -1):
+        if tail[-size:] == head[:size]:
+            first = segments[0]._replace(text=" ".join(head_words[size:]))
+            return ([first] if first.text else []) + segments[1:]
+    return segments
+
+
+def _decode_long(model: WhisperModel, audio: np.ndarray, chunks: list, workers: int,
+                 chunk_seconds: float, overlap_seconds: float, beam_size: int = 5):
+    """Распознаёт группы речи длинной записи параллельно и отдаёт сегменты по порядку."""
+    groups = split_long_speech(chunks, chunk_seconds, overlap_seconds)
+    logger.info(f"Длинная запись: {len(groups)} частей, распознаём в {workers} потоков")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(lambda group=group: list(_decode_segments(model, audio, group, beam_size)))
+                   for group in groups]
+        previous = []
+        for future in futures:
+            segments = _stitch(previous, future.result())
+            yield from segments
+            previous = segments or previous
+
+
+def transcribe_stream(file_path: str, model_path: str, device: str = "cpu", compute_type: str = "int8",
+                      cpu_threads: int = 0, use_cache: bool = True, beam_size: int = 5, replicas: int = None):
+    """Генератор ``TranscriptSegment`` по мере декодирования – потребитель может начать работу
+    с первыми сегментами или прекратить распознавание, просто перестав итерировать.
+
+    Результат полностью прочитанного потока сохраняется в кэш; при попадании модель не загружается.
+    """
+    long_threads, long_workers = stream_layout(cpu_threads, replicas, long_audio=True)
+    # длинные записи с несколькими репликами режутся на части и сшиваются – от этого зависит текст
+    long_audio = ([ASR_LONG_AUDIO_SECONDS, ASR_LONG_AUDIO_CHUNK_SECONDS, ASR_LONG_AUDIO_OVERLAP_SECONDS]
+                  if long_workers > 1 else None)
+    key = None
+    if use_cache:
+        key = _cache_key(file_path, "stream", beam_size, model=model_path, compute_type=compute_type,
+                         long_audio=long_audio)
+    if key:
+        cached = get_transcript_cache().get(key)
+        if cached is not None:
+            logger.info(f"{os.path.basename(file_path)}: текст взят из кэша")
+            ASR_CACHE_HITS.inc(mode="stream")
+            for segment in cached["segments"]:
+                yield TranscriptSegment(*segment)
+            return
+
+    started = time.perf_counter()
+    audio, chunks = _prepare_speech(file_path)
+    speech_seconds = sum(chunk["end"] - chunk["start"] for chunk in chunks) / SAMPLE_RATE
+    if chunks and long_workers > 1 and speech_seconds > ASR_LONG_AUDIO_SECONDS:
+        model = get_model(model_path, device, compute_type, long_threads, num_workers=long_workers)
+        decoded = _decode_long(model, audio, chunks, long_workers, ASR_LONG_AUDIO_CHUNK_SECONDS,
+                               ASR_LONG_AUDIO_OVERLAP_SECONDS, beam_size)
+    elif chunks:
+        model = get_model(model_path, device, compute_type, *stream_layout(cpu_threads, replicas))
+        decoded = _decode_segments(model, audio, chunks, beam_size)
+    else:
+        decoded = []
+
+    segments = []
+    for segment in decoded:
+        segments.append(segment)
+        yield segment
+    # с потребителем, который обрабатывает сегменты по ходу, сюда входит и его время
+    _observe("stream", len(audio) / SAMPLE_RATE, time.perf_counter() - started)
+
+    if key:
+        get_transcript_cache().put(key, {"segments": [list(segment) for segment in segments]})
+
+
+def transcribe_audio(file_path: str, model_path: str, device: str = "cpu", compute_type: str = "int8",
+                     cpu_threads: int = 0, use_cache: bool = True, beam_size: int = 5, replicas: int = None) -> str:
+    segments = transcribe_stream(file_path, model_path, device, compute_type, cpu_threads, use_cache, beam_size,
+                                 replicas)
     full_text = " ".join(segment.text for segment in segments).strip()
     logger.info(f"Распознанный текст: {full_text}")
-    return full_text
\ No newline at end of file
+    return full_text
+
+
+def needs_escalation(segments: list, avg_logprob_threshold: float = -0.7, compression_ratio_threshold: float = 2.4,
+                     no_speech_threshold: float = 0.5) -> bool:
+    """Решает, нужно ли перераспознать файл большой моделью по метрикам сегментов малой модели."""
+    if not segments:
+        return True
+    durations = [max(segment.end - segment.start, 0.01) for segment in segments]
+    total = sum(durations)
+    avg_logprob = sum(segment.avg_logprob * d for segment, d in zip(segments, durations)) / total
+    no_speech_prob = sum(segment.no_speech_prob * d for segment, d in zip(segments, durations)) / total
+    compression_ratio = max(segment.compression_ratio for segment in segments)
+    return (avg_logprob < avg_logprob_threshold
+            or compression_ratio > compression_ratio_threshold
+            or no_speech_prob > no_speech_threshold)
+
+
+_cascade_stats = {"draft": 0, "full": 0}
+
+
+def transcribe_cascade(file_path: str, draft_model_path: str, model_path: str, device: str = "cpu",
+                       compute_type: str = "int8", cpu_threads: int = 0, avg_logprob_threshold: float = -0.7,
+                       compression_ratio_threshold: float = 2.4, no_speech_threshold: float = 0.5,
+                       use_cache: bool = True):
+    """Каскад: сначала малая модель, большая – только если малая не уверена.
+
+    Возвращает текст и уровень, на котором закончилось распознавание: ``"draft"`` или ``"full"``.
+    """
+    key = _cache_key(file_path, "cascade", draft_model=draft_model_path, model=model_path,
+                     compute_type=compute_type, thresholds=[avg_logprob_threshold, compression_ratio_threshold,
+                                                            no_speech_threshold]) if use_cache else None
+    if key:
+        cached = get_transcript_cache().get(key)
+        if cached is not None:
+            logger.info(f"{os.path.basename(file_path)}: текст взят из кэша ({cached['tier']})")
+            ASR_CACHE_HITS.inc(mode="cascade")
+            return cached["text"], cached["tier"]
+
+    started = time.perf_counter()
+    audio, chunks = _prepare_speech(file_path)
+    if not chunks:
+        if key:
+            get_transcript_cache().put(key, {"text": "", "tier": "draft"})
+        return "", "draft"
+
+    draft = get_model(draft_model_path, device, compute_type, cpu_threads)
+    segments = list(_decode_segments(draft, audio, chunks))
+    tier = "draft"
+    if needs_escalation(segments, avg_logprob_threshold, compression_ratio_threshold, no_speech_threshold):
+        logger.info(f"{os.path.basename(file_path)}: модель {draft_model_path} не уверена, распознаём {model_path}")
+        model = get_model(model_path, device, compute_type, cpu_threads)
+        segments = list(_decode_segments(model, audio, chunks))
+        tier = "full"
+
+    with _models_lock:
+        _cascade_stats[tier] += 1
+    _observe(f"cascade_{tier}", len(audio) / SAMPLE_RATE, time.perf_counter() - started)
+    full_text = " ".join(segment.text for segment in segments).strip()
+    logger.info(f"Распознанный текст ({tier}): {full_text}")
+    if key:
+        get_transcript_cache().put(key, {"text": full_text, "tier": tier})
+    return full_text, tier
+
+
+def get_cache_stats() -> dict:
+    """Счётчики попаданий и промахов кэша распознанных текстов."""
+    cache = get_transcript_cache()
+    return cache.stats() if cache else {"hits": 0, "misses": 0, "hit_rate": 0.0, "bytes": 0}
+
+
+def get_cascade_stats() -> dict:
+    """Сколько файлов завершилось на каждом уровне каскада и доля эскалаций."""
+    with _models_lock:
+        stats = dict(_cascade_stats)
+    total = stats["draft"] + stats["full"]
+    stats["escalation_rate"] = stats["full"] / total if total else 0.0
+    return stats
+
+
+def transcribe_many(paths: list, model_path: str, device: str = "cpu", compute_type: str = "int8",
+                    cpu_threads: int = 0, batch_size: int = 8, files_per_pass: int = 32, use_cache: bool = True,
+                    beam_size: int = 5) -> list:
+    """Распознаёт много файлов сразу: речевые фрагменты всех файлов прохода собираются в общие батчи.
+
+    Возвращает тексты в порядке ``paths``; для файлов без речи или с ошибкой декодирования – пустую строку.
+    """
+    options = vad_options(max_speech_duration_s=30)
+    results = [""] * len(paths)
+
+    keys = [None] * len(paths)
+    pending = []
+    for index, path in enumerate(paths):
+        if use_cache:
+            keys[index] = _cache_key(path, "batch", beam_size, model=model_path, compute_type=compute_type)
+            cached = get_transcript_cache().get(keys[index]) if keys[index] else None
+            if cached is not None:
+                results[index] = cached["text"]
+                logger.info(f"{os.path.basename(path)}: текст взят из кэша")
+                ASR_CACHE_HITS.inc(mode="batch")
+                continue
+        pending.append(index)
+    if not pending:
+        return results
+
+    pipeline = BatchedInferencePipeline(model=get_model(model_path, device, compute_type, cpu_threads))
+    for pass_start in range(0, len(pending), files_per_pass):
+        started = time.perf_counter()
+        indices, audios, clips = [], [], []
+        offset = 0
+        for index in pending[pass_start:pass_start + files_per_pass]:
+            try:
+                audio = load_audio(paths[index])
+            except Exception as e:
+                logger.error(f"Не удалось декодировать {paths[index]}: {e}")
+                continue
+            speech = merge_segments(detect_speech(audio, options, os.path.basename(paths[index])), options)
+            if not speech:
+                logger.info(f"В {paths[index]} речь не обнаружена")
+                if keys[index]:
+                    get_transcript_cache().put(keys[index], {"text": ""})
+                continue
+            clips.extend({"start": (offset + chunk["start"]) / SAMPLE_RATE,
+                          "end": (offset + chunk["end"]) / SAMPLE_RATE} for chunk in speech)
+            indices.append(index)
+            audios.append(audio)
+            offset += len(audio)
+
+        if not audios:
+            continue
+
+        # Сегменты файла лежат внутри его диапазона в общей склейке, по нему и раскладываем текст
+        file_starts = np.cumsum([0] + [len(audio) for audio in audios[:-1]]) / SAMPLE_RATE
+        texts = [[] for _ in indices]
+        segments, _ = pipeline.transcribe(np.concatenate(audios), language="ru", beam_size=beam_size,
+                                          clip_timestamps=clips, batch_size=batch_size)
+        for segment in segments:
+            position = int(np.searchsorted(file_starts, (segment.start + segment.end) / 2, side="right")) - 1
+            texts[position].append(segment.text)
+
+        for index, parts in zip(indices, texts):
+            results[index] = " ".join(parts).strip()
+            logger.info(f"Распознанный текст {os.path.basename(paths[index])}: {results[index]}")
+            if keys[index]:
+                get_transcript_cache().put(keys[index], {"text": results[index]})
+
+        # время прохода делится между файлами пропорционально длительности
+        seconds, total = time.perf_counter() - started, sum(len(audio) for audio in audios)
+        for audio in audios:
+            _observe("batch", len(audio) / SAMPLE_RATE, seconds * len(audio) / total)
+
+    return results
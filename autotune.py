@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# compute_type, которые имеет смысл сравнивать на CPU (пересекаются с поддерживаемыми хостом)
+CPU_COMPUTE_TYPES = ("int8", "int8_float32", "int8_bfloat16", "bfloat16", "float32")
+
+CLIP_SECONDS = 8
+SAMPLE_RATE = 16000
+
+
+def _cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def available_memory():
+    """Доступная память (MemAvailable) в байтах; None, если её не узнать."""
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def model_size(model_path):
+    """Размер файлов модели на диске – оценка памяти одной её копии; None, если модель не в локальном каталоге."""
+    from asr import resolve_model_path
+
+    path, _ = resolve_model_path(model_path)
+    if not os.path.isdir(path):
+        return None
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def max_model_copies(model_path, reserve=0.25):
+    """Сколько отдельных копий модели (процессов пула) помещается в доступную память, оставляя долю
+    ``reserve`` под LLM и остальное; None – оценить нельзя."""
+    memory, size = available_memory(), model_size(model_path)
+    if not memory or not size:
+        return None
+    return max(1, int(memory * (1 - reserve) // size))
+
+
+def host_fingerprint(model_path):
+    """Отпечаток хоста: модель процессора, доступные ядра, версия CTranslate2 и модель Whisper."""
+    import ctranslate2
+
+    parts = [_cpu_model(), str(_cpu_count()), platform.machine(), ctranslate2.__version__, model_path]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def load_clip(path=None):
+    """Короткий клип для замеров: файл ``path``, если он есть, иначе синтетический сигнал.
+
+    Синтетика – набор гармоник с речевой огибающей; для сравнения конфигураций между собой
+    важна не разборчивость, а одинаковая нагрузка на энкодер и декодер.
+    """
+    if path and os.path.exists(path):
+        from asr import load_audio
+        return load_audio(path)[:CLIP_SECONDS * SAMPLE_RATE]
+
+    t = np.arange(CLIP_SECONDS * SAMPLE_RATE) / SAMPLE_RATE
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 3 * t)) * (np.sin(2 * np.pi * 0.4 * t) > -0.6)
+    noise = np.random.default_rng(0).normal(0, 0.01, t.shape)
+    return (0.3 * voice * envelope + noise).astype(np.float32)
+
+
+def thread_layouts(cores):
+    """Варианты (воркеры, потоков на воркер), использующие все ядра."""
+    layouts = []
+    workers = 1
+    while workers <= cores:
+        layouts.append((workers, cores // workers))
+        workers *= 2
+    return layouts
+
+
+def measure(model_path, compute_type, workers, threads, clip, rounds=2):
+    """Пропускная способность конфигурации: секунд аудио в секунду.
+
+    ``workers`` – реплики (``num_workers``) одной модели в этом процессе, и именно так подобранная
+    раскладка и применяется (main.get_asr_settings), а не как пул процессов с отдельными копиями модели.
+    """
+    from faster_whisper import WhisperModel
+    from asr import resolve_model_path
+
+    path, local = resolve_model_path(model_path)
+    model = WhisperModel(path, device="cpu", compute_type=compute_type, cpu_threads=threads,
+                         num_workers=workers, local_files_only=local)
+
+    def decode():
+        segments, _ = model.transcribe(clip, beam_size=5, language="ru", vad_filter=False)
+        list(segments)
+
+    decode()  # прогрев
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(decode) for _ in range(workers * rounds)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    return workers * rounds * len(clip) / SAMPLE_RATE / elapsed
+
+
+def autotune(model_path, clip_path=None):
+    """Подбирает compute_type и раскладку потоков для CPU этого хоста.
+
+    Сначала сравниваются compute_type на одном воркере со всеми ядрами, затем для лучшего
+    из них – варианты разбиения ядер на воркеры. Конфигурации, которые не загружаются, пропускаются.
+    """
+    import ctranslate2
+
+    cores = _cpu_count()
+    clip = load_clip(clip_path)
+    supported = set(ctranslate2.get_supported_compute_types("cpu"))
+    candidates = [compute_type for compute_type in CPU_COMPUTE_TYPES if compute_type in supported]
+    logger.info(f"Autotune: {cores} cores, compute types {candidates}")
+
+    results = []
+    best_compute, best_speed = None, 0.0
+    for compute_type in candidates:
+        try:
+            speed = measure(model_path, compute_type, 1, cores, clip)
+        except Exception as e:
+            logger.warning(f"Autotune: {compute_type} skipped: {e}")
+            continue
+        results.append({"compute_type": compute_type, "workers": 1, "threads_per_worker": cores, "speed": speed})
+        logger.info(f"Autotune: {compute_type} x1 worker x{cores} threads: {speed:.2f} audio s/s")
+        if speed > best_speed:
+            best_compute, best_speed = compute_type, speed
+
+    if best_compute is None:
+        raise RuntimeError("no valid compute_type found")
+
+    best = {"compute_type": best_compute, "workers": 1, "threads_per_worker": cores, "speed": best_speed}
+    for workers, threads in thread_layouts(cores)[1:]:
+        try:
+            speed = measure(model_path, best_compute, workers, threads, clip)
+        except Exception as e:
+            logger.warning(f"Autotune: {workers}x{threads} skipped: {e}")
+            continue
+        results.append({"compute_type": best_compute, "workers": workers, "threads_per_worker": threads,
+                        "speed": speed})
+        logger.info(f"Autotune: {best_compute} x{workers} workers x{threads} threads: {speed:.2f} audio s/s")
+        if speed > best["speed"]:
+            best = {"compute_type": best_compute, "workers": workers, "threads_per_worker": threads, "speed": speed}
+
+    best["candidates"] = results
+    return best
+
+
+_lock = threading.Lock()
+
+
+def resolve_asr_settings(model_path, results_file, clip_path=None):
+    """Настройки ASR для этого хоста: из ``results_file`` по отпечатку или после autotune (результат сохраняется)."""
+    with _lock:
+        fingerprint = host_fingerprint(model_path)
+        try:
+            with open(results_file, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+
+        if fingerprint in stored:
+            return stored[fingerprint]
+
+        logger.info(f"Autotune: no stored settings for host {fingerprint}, benchmarking {model_path}...")
+        started = time.perf_counter()
+        best = autotune(model_path, clip_path)
+        best.update(fingerprint=fingerprint, cpu=_cpu_model(), measured_at=time.strftime("%Y-%m-%d %H:%M:%S"),
+                    tuning_seconds=time.perf_counter() - started)
+        logger.info(f"Autotune: selected {best['compute_type']}, {best['workers']} workers x "
+                    f"{best['threads_per_worker']} threads ({best['tuning_seconds']:.0f} s)")
+
+        stored[fingerprint] = best
+        tmp_file = f"{results_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(stored, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, results_file)
+        return best
@@ -0,0 +1,158 @@
+"""Замер скорости и качества распознавания для разных моделей, compute_type, beam_size и размера батча.
+
+Каталог с эталонными WAV; рядом с ``msg0001.wav`` может лежать ``msg0001.txt`` с правильным текстом –
+тогда считается WER. Каждая конфигурация запускается в отдельном процессе, чтобы пиковый RSS
+и время загрузки модели не смешивались. Работает полностью офлайн: модели должны быть в локальном кэше.
+
+Размер батча 1 – поштучное распознавание через ``transcribe_audio`` одной репликой модели,
+больше 1 – батчевый проход ``transcribe_many``, которым по умолчанию распознаёт сервис (ASR_BATCH_SIZE).
+Время загрузки меряется на той же модели, которой затем распознаются файлы.
+
+Запуск из корня проекта::
+
+    python benchmarks/asr_benchmark.py reference_audio --models large small \\
+        --compute-types int8 int8_float32 float32 --beam-sizes 5 1 --batch-sizes 1 8 --json asr_benchmark.json
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def normalize(text):
+    text = text.lower().replace("ё", "е")
+    return re.sub(r"[^\w\s]", " ", text).split()
+
+
+def word_errors(reference, hypothesis):
+    """Расстояние Левенштейна по словам."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+
+def run_config(directory, model_path, compute_type, beam_size, cpu_threads, batch_size=1):
+    """Выполняется в дочернем процессе: одна конфигурация на все файлы каталога."""
+    from asr import (SAMPLE_RATE, get_model, get_model_stats, load_audio, stream_layout, transcribe_audio,
+                     transcribe_many)
+
+    # та же модель, что загрузят transcribe_many и transcribe_audio с replicas=1
+    started = time.perf_counter()
+    if batch_size > 1:
+        get_model(model_path, "cpu", compute_type, cpu_threads)
+    else:
+        get_model(model_path, "cpu", compute_type, *stream_layout(cpu_threads, 1))
+    load_seconds = time.perf_counter() - started
+
+    files = sorted(glob.glob(os.path.join(directory, "*.wav")))
+    audio_seconds = sum(len(load_audio(path)) / SAMPLE_RATE for path in files)
+    started = time.perf_counter()
+    if batch_size > 1:
+        texts = transcribe_many(files, model_path, "cpu", compute_type, cpu_threads, batch_size=batch_size,
+                                use_cache=False, beam_size=beam_size)
+    else:
+        texts = [transcribe_audio(path, model_path, "cpu", compute_type, cpu_threads, use_cache=False,
+                                  beam_size=beam_size, replicas=1) for path in files]
+    decode_seconds = time.perf_counter() - started
+
+    errors = reference_words = 0
+    for path, text in zip(files, texts):
+        reference_path = os.path.splitext(path)[0] + ".txt"
+        if os.path.exists(reference_path):
+            with open(reference_path, encoding="utf-8") as f:
+                reference = normalize(f.read())
+            errors += word_errors(reference, normalize(text))
+            reference_words += len(reference)
+
+    return {
+        "model": model_path,
+        "compute_type": compute_type,
+        "beam_size": beam_size,
+        "batch_size": batch_size,
+        "cpu_threads": cpu_threads,
+        "files": len(files),
+        "audio_seconds": audio_seconds,
+        "decode_seconds": decode_seconds,
+        "rtf": decode_seconds / audio_seconds if audio_seconds else None,
+        "load_seconds": load_seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "wer": errors / reference_words if reference_words else None,
+        "model_stats": get_model_stats(),
+    }
+
+
+def print_table(results):
+    header = (f"{'модель':<10} {'compute':<14} {'beam':>4} {'батч':>4} {'RTF':>7} {'загрузка,с':>11} "
+              f"{'RSS,МБ':>8} {'WER':>7}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        if "error" in r:
+            print(f"{r['model']:<10} {r['compute_type']:<14} {r['beam_size']:>4} {r['batch_size']:>4}  "
+                  f"ошибка: {r['error']}")
+            continue
+        rtf = f"{r['rtf']:.3f}" if r["rtf"] is not None else "-"
+        wer = f"{r['wer']:.3f}" if r["wer"] is not None else "-"
+        print(f"{r['model']:<10} {r['compute_type']:<14} {r['beam_size']:>4} {r['batch_size']:>4} {rtf:>7} "
+              f"{r['load_seconds']:>11.1f} {r['peak_rss_mb']:>8.0f} {wer:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="каталог с эталонными WAV (и необязательными .txt)")
+    parser.add_argument("--models", nargs="+", default=["large"])
+    parser.add_argument("--compute-types", nargs="+", default=["int8", "int8_float32", "float32"])
+    parser.add_argument("--beam-sizes", nargs="+", type=int, default=[5])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8],
+                        help="1 – поштучно через transcribe_audio, больше 1 – батчем через transcribe_many")
+    parser.add_argument("--cpu-threads", type=int, default=0)
+    parser.add_argument("--json", help="куда сохранить результаты в JSON")
+    parser.add_argument("--single", help=argparse.SUPPRESS)  # внутренний режим: одна конфигурация
+    args = parser.parse_args()
+
+    if args.single:
+        model_path, compute_type, beam_size, batch_size = json.loads(args.single)
+        print(json.dumps(run_config(args.directory, model_path, compute_type, beam_size, args.cpu_threads,
+                                    batch_size)))
+        return
+
+    env = dict(os.environ, HF_HUB_OFFLINE="1", TRANSFORMERS_OFFLINE="1")
+    results = []
+    configs = itertools.product(args.models, args.compute_types, args.beam_sizes, args.batch_sizes)
+    for model_path, compute_type, beam_size, batch_size in configs:
+        print(f"== {model_path} / {compute_type} / beam {beam_size} / batch {batch_size}", file=sys.stderr)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), args.directory, "--cpu-threads", str(args.cpu_threads),
+             "--single", json.dumps([model_path, compute_type, beam_size, batch_size])],
+            cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True,
+        )
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode == 0 and lines:
+            results.append(json.loads(lines[-1]))
+        else:
+            results.append({"model": model_path, "compute_type": compute_type, "beam_size": beam_size,
+                            "batch_size": batch_size, "error": f"exit code {proc.returncode}"})
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Сравнение подготовки аудио для Whisper: конвертация через ``_converted.wav`` против декодирования в память.
+
+Запуск из корня проекта::
+
+    python benchmarks/decode_benchmark.py downloaded_audio/msg0001.wav downloaded_audio/msg0002.wav --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from faster_whisper.audio import decode_audio as whisper_decode_audio  # noqa: E402
+
+from asr import convert_to_16k_mono, decode_audio  # noqa: E402
+
+
+def run_file_path(path):
+    """Старый путь: pydub пишет ``_converted.wav``, faster-whisper читает его обратно."""
+    started = time.perf_counter()
+    converted = convert_to_16k_mono(path)
+    whisper_decode_audio(converted, sampling_rate=16000)
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(converted)
+    os.remove(converted)
+    # Файл записывается на диск и затем читается целиком
+    return elapsed, size * 2
+
+
+def run_in_memory(path):
+    started = time.perf_counter()
+    decode_audio(path)
+    return time.perf_counter() - started, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+", help="аудиофайлы для замера")
+    parser.add_argument("--repeat", type=int, default=3, help="число повторов на файл")
+    args = parser.parse_args()
+
+    results = {}
+    for name, runner in (("file", run_file_path), ("memory", run_in_memory)):
+        times, io_bytes = [], []
+        for path in args.files:
+            for _ in range(args.repeat):
+                elapsed, nbytes = runner(path)
+                times.append(elapsed)
+                io_bytes.append(nbytes)
+        results[name] = {
+            "calls": len(times),
+            "mean_seconds": statistics.mean(times),
+            "median_seconds": statistics.median(times),
+            "temp_io_bytes_per_call": statistics.mean(io_bytes),
+        }
+
+    saved = results["file"]["mean_seconds"] - results["memory"]["mean_seconds"]
+    results["saved_seconds_per_call"] = saved
+    results["saved_io_bytes_per_call"] = results["file"]["temp_io_bytes_per_call"]
+
+    print(f"{'путь':<8} {'вызовов':>8} {'среднее, с':>12} {'медиана, с':>12} {'диск, байт':>12}")
+    for name in ("file", "memory"):
+        r = results[name]
+        print(f"{name:<8} {r['calls']:>8} {r['mean_seconds']:>12.4f} {r['median_seconds']:>12.4f} "
+              f"{r['temp_io_bytes_per_call']:>12.0f}")
+    print(f"Экономия на вызов: {saved:.4f} с, {results['saved_io_bytes_per_call']:.0f} байт дискового I/O")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Assisted decoding с черновой моделью против обычного ``model.generate`` в ``nlu``.
+
+Оба режима извлекают данные из одних и тех же текстов по одному (assisted decoding работает
+только с батчем 1); сравниваются время на текст, токены в секунду, доля принятых токенов
+черновика и совпадение результатов – при жадном декодировании они должны быть идентичны.
+
+Запуск из корня проекта::
+
+    python benchmarks/llm_assisted_benchmark.py --draft Qwen/Qwen3-0.6B-Base --texts transcripts.txt
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from llm_prefix_benchmark import SAMPLE_TEXTS  # noqa: E402
+
+
+def run(texts, tokenizer, model, draft_model, repeat):
+    import nlu
+
+    best, claims, stats = None, None, None
+    for _ in range(repeat):
+        nlu._stats.update(new_tokens=0, generate_seconds=0.0, target_calls=0, draft_calls=0)
+        started = time.perf_counter()
+        claims = [nlu._generate_claim(text, tokenizer, model, draft_model=draft_model)[0] for text in texts]
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best, stats = elapsed, nlu.get_nlu_stats()
+    return {
+        "ms_per_text": 1000 * best / len(texts),
+        "tokens_per_second": stats["tokens_per_second"],
+        "acceptance_rate": stats.get("acceptance_rate"),
+        "claims": claims,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--draft", required=True, help="черновая модель (тот же токенизатор, что у LLM_MODEL_NAME)")
+    parser.add_argument("--texts", help="файл с транскриптами, по одному на строку")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    import main as app
+    import nlu
+    from config import LLM_DRAFT_MODEL_NAME, LLM_DRAFT_QUANTIZED_DIR, LLM_QUANTIZED, MODEL_STORE_DIR
+
+    texts = SAMPLE_TEXTS
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    # артефакт черновой модели – по тому же правилу, что LLM_DRAFT_QUANTIZED_DIR в config.py, но для --draft
+    draft_dir = (LLM_DRAFT_QUANTIZED_DIR if args.draft == LLM_DRAFT_MODEL_NAME
+                 else os.path.join(MODEL_STORE_DIR, "llm", args.draft.replace("/", "--") + "-int8"))
+
+    app.init_models(warm_asr=False)
+    draft_model = nlu.load_draft_model(args.draft, app.tokenizer, draft_dir if LLM_QUANTIZED else None)
+    if draft_model is None:
+        raise SystemExit(f"{args.draft}: словарь не совпадает с основной моделью")
+
+    results = {
+        "generate": run(texts, app.tokenizer, app.model, None, args.repeat),
+        "assisted": run(texts, app.tokenizer, app.model, draft_model, args.repeat),
+    }
+    identical = results["generate"]["claims"] == results["assisted"]["claims"]
+
+    print(f"{'режим':<10} {'мс/текст':>10} {'ток/с':>8} {'принято':>8}")
+    for name, r in results.items():
+        acceptance = f"{r['acceptance_rate']:.0%}" if r["acceptance_rate"] is not None else "-"
+        print(f"{name:<10} {r['ms_per_text']:>10.0f} {r['tokens_per_second']:>8.1f} {acceptance:>8}")
+    print(f"результаты совпадают: {'да' if identical else 'НЕТ'}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(dict(results, identical=identical), f, ensure_ascii=False, indent=2)
+    raise SystemExit(0 if identical else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Сколько времени prefill экономит KV-кэш постоянной части промпта (``nlu.PromptPrefixCache``).
+
+Для каждого текста замеряется один проход модели по полному промпту и по хвосту поверх копии кэша
+префикса, а также полное извлечение (generate) с кэшем и без него – поштучно и батчем.
+Тексты – по одному на строку из ``--texts``; без него используются примеры ниже.
+
+Запуск из корня проекта::
+
+    python benchmarks/llm_prefix_benchmark.py --texts transcripts.txt --repeat 3
+"""
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_TEXTS = [
+    "Добрый день, это Сергей Иванов, поезд сто двадцать пять, в седьмом вагоне не работает кондиционер.",
+    "Поезд 817, вагон 3, пропадает свет в купе, серийный номер 0456-12.",
+    "Здравствуйте, у нас в двенадцатом вагоне не идёт вода, поезд сорок два.",
+    "Это Петров Алексей, в вагоне пять сломан замок туалета, поезд номер 301.",
+]
+
+
+def median_seconds(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", help="файл с транскриптами, по одному на строку")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    import torch
+    import main as app
+    import nlu
+
+    texts = SAMPLE_TEXTS
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    app.init_models(warm_asr=False)
+    tokenizer, model = app.tokenizer, app.model
+    started = time.perf_counter()
+    prefix_cache = nlu.PromptPrefixCache(tokenizer, model)
+    build_seconds = time.perf_counter() - started
+
+    def prefill_full(text):
+        ids = tokenizer(nlu.build_prompt(text), return_tensors="pt")["input_ids"].to(model.device)
+        with torch.no_grad():
+            model(ids, use_cache=True)
+
+    def prefill_tail(text):
+        ids = tokenizer(nlu.build_prompt_tail(text), return_tensors="pt",
+                        add_special_tokens=False)["input_ids"].to(model.device)
+        with torch.no_grad():
+            model(ids, past_key_values=copy.deepcopy(prefix_cache.past_key_values), use_cache=True)
+
+    full = [median_seconds(lambda: prefill_full(text), args.repeat) for text in texts]
+    tail = [median_seconds(lambda: prefill_tail(text), args.repeat) for text in texts]
+
+    def extract(prefix, batch_size):
+        return lambda: nlu._generate_claims(texts, tokenizer, model, batch_size, prefix)
+
+    results = {
+        "texts": len(texts),
+        "prefix_tokens": len(prefix_cache),
+        "prefix_build_seconds": build_seconds,
+        "prefill_full_ms": 1000 * statistics.mean(full),
+        "prefill_cached_ms": 1000 * statistics.mean(tail),
+        "prefill_saved_ms": 1000 * (statistics.mean(full) - statistics.mean(tail)),
+        "extract_single_ms": 1000 * median_seconds(extract(None, 1), args.repeat) / len(texts),
+        "extract_single_cached_ms": 1000 * median_seconds(extract(prefix_cache, 1), args.repeat) / len(texts),
+        "extract_batch_ms": 1000 * median_seconds(extract(None, len(texts)), args.repeat) / len(texts),
+        "extract_batch_cached_ms": 1000 * median_seconds(extract(prefix_cache, len(texts)), args.repeat) / len(texts),
+    }
+
+    print(f"префикс: {results['prefix_tokens']} токенов, построение {results['prefix_build_seconds']:.2f} с")
+    print(f"{'на транскрипт, мс':<26} {'без кэша':>10} {'с кэшем':>10}")
+    print(f"{'prefill':<26} {results['prefill_full_ms']:>10.1f} {results['prefill_cached_ms']:>10.1f}")
+    print(f"{'извлечение поштучно':<26} {results['extract_single_ms']:>10.1f} "
+          f"{results['extract_single_cached_ms']:>10.1f}")
+    print(f"{'извлечение батчем':<26} {results['extract_batch_ms']:>10.1f} {results['extract_batch_cached_ms']:>10.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Время старта и пиковый RSS ``main.init_models`` с исходной и квантизованной LLM.
+
+Каждый вариант запускается в отдельном процессе (модели ASR не прогреваются). Квантизованный
+артефакт должен быть уже собран – его создаёт первый запуск с ``LLM_QUANTIZED=1``.
+
+Кроме пикового RSS выводится, сколько памяти после старта занимают страницы файлов (``RssFile``,
+в том числе тензоры, прочитанные через mmap) и анонимная память процесса (``RssAnon``, Linux).
+Упакованные int8-веса Linear при загрузке переупаковываются и попадают в ``RssAnon``.
+
+Запуск из корня проекта::
+
+    python benchmarks/llm_startup_benchmark.py --repeat 3
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def rss_breakdown():
+    """RssAnon и RssFile процесса в МБ из /proc/self/status; пусто, если их там нет."""
+    result = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("RssAnon", "RssFile"):
+                    result[f"{name[3:].lower()}_rss_mb"] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return result
+
+
+def run_once():
+    """Выполняется в дочернем процессе."""
+    started = time.perf_counter()
+    import main
+    main.init_models(warm_asr=False)
+    return {
+        "startup_seconds": time.perf_counter() - started,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        **rss_breakdown(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_once()))
+        return
+
+    results = {}
+    for name, quantized in (("float32", "0"), ("int8", "1")):
+        runs = []
+        for _ in range(args.repeat):
+            env = dict(os.environ, LLM_QUANTIZED=quantized, ASR_AUTOTUNE="0", HF_HUB_OFFLINE="1")
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--single"], cwd=ROOT, env=env,
+                                  stdout=subprocess.PIPE, text=True, check=True)
+            runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        results[name] = {key: statistics.median(r.get(key, 0) for r in runs)
+                         for key in ("startup_seconds", "peak_rss_mb", "anon_rss_mb", "file_rss_mb")}
+        results[name]["runs"] = runs
+
+    print(f"{'модель':<8} {'старт, с':>10} {'RSS, МБ':>10} {'анонимная':>10} {'файлы':>10}")
+    for name, r in results.items():
+        print(f"{name:<8} {r['startup_seconds']:>10.1f} {r['peak_rss_mb']:>10.0f} {r['anon_rss_mb']:>10.0f} "
+              f"{r['file_rss_mb']:>10.0f}")
+    print("int8-веса Linear не отображаются из файла: они в анонимной памяти каждого процесса")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
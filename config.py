@@ -11,18 +11,117 @@ SFTP_PASSWORD = os.getenv("SFTP_PASSWORD")
 SFTP_PORT = int(os.getenv("SFTP_PORT", "22"))
 SFTP_REMOTE_PATH = "."  
 LOCAL_DOWNLOAD_PATH = "downloaded_audio"
-PROCESSED_FILES_LOG = "processed_files.log"
+PROCESSED_FILES_LOG = "processed_files.log"  # старый журнал, переносится в JOB_STORE_PATH при первом запуске
+# Состояние обработки файлов (этап, текст, данные, id заявки) в SQLite
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.sqlite3")
 
 # GLPI Configuration
 GLPI_URL = os.getenv("GLPI_URL", "https://ticket.peremena.ru/apirest.php/")
 GLPI_APP_TOKEN = os.getenv("GLPI_APP_TOKEN")
 GLPI_USER_TOKEN = os.getenv("GLPI_USER_TOKEN")
+# Соединений в пуле requests общей сессии GLPI (не меньше PIPELINE_GLPI_WORKERS)
+GLPI_POOL_SIZE = int(os.getenv("GLPI_POOL_SIZE", "4"))
+# Заявки создаются пачками одним запросом: пачка отправляется, когда набралось GLPI_BULK_SIZE заявок
+# или прошло GLPI_BULK_SECONDS с момента появления первой (1 – по одной)
+GLPI_BULK_SIZE = int(os.getenv("GLPI_BULK_SIZE", "10"))
+GLPI_BULK_SECONDS = float(os.getenv("GLPI_BULK_SECONDS", "5"))
 
 # Audio Processing
 WHISPER_MODEL_PATH = "large"
+# Локальное хранилище моделей (python model_store.py fetch large). При MODEL_STORE_OFFLINE=1
+# модели, которых нет в хранилище, не скачиваются, а вызывают ошибку
+MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR", "models")
+MODEL_STORE_OFFLINE = os.getenv("MODEL_STORE_OFFLINE", "0") == "1"
 DEVICE = "cpu"
 COMPUTE_TYPE = "int8"
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", "0"))  # 0 – по числу ядер
+# Автоподбор compute_type и раскладки потоков при первом запуске на хосте (только CPU).
+# Результат сохраняется в AUTOTUNE_FILE по отпечатку хоста и заменяет COMPUTE_TYPE, а без пула
+# процессов (ASR_WORKERS=0) – и WHISPER_CPU_THREADS: подобранные воркеры становятся репликами
+# одной модели в процессе. Явно заданные ASR_WORKERS и ASR_THREADS_PER_WORKER не меняются
+ASR_AUTOTUNE = os.getenv("ASR_AUTOTUNE", "1") == "1"
+AUTOTUNE_FILE = os.getenv("AUTOTUNE_FILE", "autotune.json")
+AUTOTUNE_CLIP = os.getenv("AUTOTUNE_CLIP")  # свой клип для замеров; по умолчанию – синтетический
+ASR_BATCH_SIZE = int(os.getenv("ASR_BATCH_SIZE", "8"))  # 1 – распознавать файлы по одному
+ASR_BATCH_FILES = int(os.getenv("ASR_BATCH_FILES", "32"))  # файлов в одном батчевом проходе
+# Пул процессов распознавания (0 или 1 – без пула): каждый воркер держит свою копию модели,
+# поэтому число воркеров ограничивается доступной памятью
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", "0"))
+ASR_THREADS_PER_WORKER = int(os.getenv("ASR_THREADS_PER_WORKER", "4"))
+ASR_PIN_CPUS = os.getenv("ASR_PIN_CPUS", "0") == "1"  # закрепить воркеры за непересекающимися ядрами
+# Длинные записи: речь дольше ASR_LONG_AUDIO_SECONDS режется по паузам на части
+# до ASR_LONG_AUDIO_CHUNK_SECONDS, которые распознаются параллельно (1 – без параллельного режима).
+# Для них загружается модель из ASR_LONG_AUDIO_WORKERS реплик, потоки ASR делятся между ними; короткие
+# записи распознаются одной репликой на все потоки. Пул процессов и раскладка autotune частей не режут
+ASR_LONG_AUDIO_SECONDS = float(os.getenv("ASR_LONG_AUDIO_SECONDS", "90"))
+ASR_LONG_AUDIO_CHUNK_SECONDS = float(os.getenv("ASR_LONG_AUDIO_CHUNK_SECONDS", "30"))
+ASR_LONG_AUDIO_OVERLAP_SECONDS = float(os.getenv("ASR_LONG_AUDIO_OVERLAP_SECONDS", "1.0"))
+ASR_LONG_AUDIO_WORKERS = int(os.getenv("ASR_LONG_AUDIO_WORKERS", "4"))
+# Отсечение тишины, гудков и шума перед распознаванием (Silero VAD)
+VAD_THRESHOLD = float(os.getenv("VAD_THRESHOLD", "0.5"))  # вероятность речи, выше которой кадр считается речью
+VAD_MIN_SPEECH_MS = int(os.getenv("VAD_MIN_SPEECH_MS", "250"))  # более короткие фрагменты речи отбрасываются
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "500"))  # пауза, после которой фрагмент речи закрывается
+VAD_SPEECH_PAD_MS = int(os.getenv("VAD_SPEECH_PAD_MS", "200"))  # запас вокруг каждого фрагмента речи
+# Досрочный отказ от безнадёжного аудио: если первые ASR_ABANDON_SEGMENTS сегментов – не речь
+# (no_speech_prob выше порога) или распознаны с очень низкой уверенностью, файл дальше не декодируется.
+# Действует при поштучном распознавании (без батча ASR_BATCH_SIZE > 1 и каскада); данные заявки
+# извлекаются из текста только после того, как файл распознан целиком
+ASR_ABANDON_SEGMENTS = int(os.getenv("ASR_ABANDON_SEGMENTS", "3"))  # 0 – не прерывать
+ASR_ABANDON_NO_SPEECH_PROB = float(os.getenv("ASR_ABANDON_NO_SPEECH_PROB", "0.8"))
+ASR_ABANDON_AVG_LOGPROB = float(os.getenv("ASR_ABANDON_AVG_LOGPROB", "-1.5"))
+# Каскад моделей: сначала ASR_CASCADE_DRAFT_MODEL, WHISPER_MODEL_PATH – только если малая модель не уверена
+ASR_CASCADE_ENABLED = os.getenv("ASR_CASCADE_ENABLED", "0") == "1"
+ASR_CASCADE_DRAFT_MODEL = os.getenv("ASR_CASCADE_DRAFT_MODEL", "small")
+ASR_ESCALATE_AVG_LOGPROB = float(os.getenv("ASR_ESCALATE_AVG_LOGPROB", "-0.7"))  # ниже – эскалация
+ASR_ESCALATE_COMPRESSION_RATIO = float(os.getenv("ASR_ESCALATE_COMPRESSION_RATIO", "2.4"))  # выше – эскалация
+ASR_ESCALATE_NO_SPEECH_PROB = float(os.getenv("ASR_ESCALATE_NO_SPEECH_PROB", "0.5"))  # выше – эскалация
+# Кэш распознанных текстов: повторная обработка того же аудио не запускает Whisper
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", "cache/transcripts")
+TRANSCRIPT_CACHE_MAX_MB = int(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "256"))  # 0 – кэш отключён
+# Кэш ответов LLM по нормализованному тексту: повторный или совпадающий транскрипт не запускает генерацию
+CLAIM_CACHE_DIR = os.getenv("CLAIM_CACHE_DIR", "cache/claims")
+CLAIM_CACHE_MAX_MB = int(os.getenv("CLAIM_CACHE_MAX_MB", "64"))  # 0 – кэш отключён
+CLAIM_CACHE_TTL_HOURS = float(os.getenv("CLAIM_CACHE_TTL_HOURS", "168"))
+CLAIM_CACHE_MEMORY_ENTRIES = int(os.getenv("CLAIM_CACHE_MEMORY_ENTRIES", "1024"))
 LLM_MODEL_NAME = "Qwen/Qwen3-1.7B-Base"
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "8"))  # текстов в одном generate при пакетной обработке
+# Квантизованная (dynamic int8) копия LLM для CPU: создаётся один раз, грузится вчетверо меньше float32.
+# Через mmap остаются только эмбеддинги и прочие обычные тензоры, int8-веса Linear – в памяти процесса
+LLM_QUANTIZED = os.getenv("LLM_QUANTIZED", "1") == "1"
+LLM_QUANTIZED_DIR = os.getenv(
+    "LLM_QUANTIZED_DIR", os.path.join(MODEL_STORE_DIR, "llm", LLM_MODEL_NAME.replace("/", "--") + "-int8"))
+# KV-кэш постоянной части промпта: считается один раз после загрузки LLM
+LLM_PREFIX_CACHE = os.getenv("LLM_PREFIX_CACHE", "1") == "1"
+# Малая модель того же семейства (тот же токенизатор) для assisted decoding; пусто – выключено.
+# Результат при жадном декодировании не меняется, извлечение идёт по одному тексту
+LLM_DRAFT_MODEL_NAME = os.getenv("LLM_DRAFT_MODEL_NAME", "")
+LLM_DRAFT_QUANTIZED_DIR = os.getenv(
+    "LLM_DRAFT_QUANTIZED_DIR",
+    os.path.join(MODEL_STORE_DIR, "llm", LLM_DRAFT_MODEL_NAME.replace("/", "--") + "-int8"))
+
+# Сервис инференса (python inference_daemon.py): держит модели ASR и LLM прогретыми между запусками
+# планировщика. Если он недоступен, модели загружаются в процессе обработки, как раньше
+INFERENCE_DAEMON_HOST = os.getenv("INFERENCE_DAEMON_HOST", "127.0.0.1")
+INFERENCE_DAEMON_PORT = int(os.getenv("INFERENCE_DAEMON_PORT", "8765"))
+INFERENCE_DAEMON_URL = os.getenv("INFERENCE_DAEMON_URL", f"http://{INFERENCE_DAEMON_HOST}:{INFERENCE_DAEMON_PORT}")
+INFERENCE_DAEMON_ENABLED = os.getenv("INFERENCE_DAEMON_ENABLED", "1") == "1"
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))  # задания сверх очереди получают 503
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "3600"))  # ожидание ответа клиентом, с
+
+# Конвейер обработки: загрузка, ASR, NLU, создание заявки и архивирование идут одновременно,
+# между этапами – очереди на PIPELINE_QUEUE_SIZE файлов (полная очередь притормаживает предыдущий этап)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+PIPELINE_FETCH_WORKERS = int(os.getenv("PIPELINE_FETCH_WORKERS", "2"))  # каждый – свой SFTP-канал
+PIPELINE_ASR_WORKERS = int(os.getenv("PIPELINE_ASR_WORKERS", "1"))
+PIPELINE_NLU_WORKERS = int(os.getenv("PIPELINE_NLU_WORKERS", "1"))
+PIPELINE_GLPI_WORKERS = int(os.getenv("PIPELINE_GLPI_WORKERS", "2"))
+PIPELINE_ARCHIVE_WORKERS = int(os.getenv("PIPELINE_ARCHIVE_WORKERS", "1"))
+
+# Метрики в формате Prometheus: планировщик отдаёт их на METRICS_HOST:METRICS_PORT/metrics (0 – не отдавать),
+# сервис инференса – на своём порту. JSON-сводка каждого запуска пишется в METRICS_SUMMARY_DIR
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_SUMMARY_DIR = os.getenv("METRICS_SUMMARY_DIR", "logs/metrics")
 
 # Archive
 ARCHIVE_DIR = "processed_archive"
\ No newline at end of file
@@ -0,0 +1,138 @@
+import logging
+import threading
+
+from requests.adapters import HTTPAdapter
+
+import metrics
+from config import GLPI_APP_TOKEN, GLPI_POOL_SIZE, GLPI_URL, GLPI_USER_TOKEN
+from glpi_api import GLPI, GLPIError
+
+logger = logging.getLogger(__name__)
+
+REQUEST_SECONDS = metrics.histogram("gse_glpi_request_seconds", "Время ответа GLPI REST API, с",
+                                    ("method", "endpoint"))
+REQUESTS = metrics.counter("gse_glpi_requests_total", "Запросы к GLPI REST API по коду ответа",
+                           ("method", "endpoint", "status"))
+SESSION_RENEWALS = metrics.counter("gse_glpi_session_renewals_total", "Обновления сессии GLPI")
+
+# Ключи ошибок GLPI, после которых достаточно открыть новую сессию
+_SESSION_ERRORS = ("ERROR_SESSION_TOKEN_INVALID", "ERROR_SESSION_TOKEN_MISSING")
+
+
+class PooledGLPI(GLPI):
+    """``GLPI`` с пулом соединений ``requests`` на ``pool_size`` соединений и обновлением сессии.
+
+    Параметры авторизации сохраняются, поэтому ``renew_session`` получает новый session_token
+    без пересоздания объекта и TLS-соединений.
+    """
+
+    def __init__(self, url, apptoken, auth, pool_size=4, verify_certs=True, use_headers=True, user_agent=None):
+        self._apptoken = apptoken
+        self._auth = auth
+        self._user_agent = user_agent
+        self._use_headers = use_headers
+        self._pool_size = pool_size
+        super().__init__(url, apptoken, auth, verify_certs, use_headers=use_headers, user_agent=user_agent)
+
+    def _init_session(self, apptoken, auth, user_agent, use_headers=True):
+        if not getattr(self, '_mounted', False):
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            self.session.hooks['response'].append(self._observe)
+            self._mounted = True
+        return super()._init_session(apptoken, auth, user_agent, use_headers=use_headers)
+
+    def _observe(self, response, *args, **kwargs):
+        # endpoint – первая часть пути после apirest.php (Ticket, initSession, search), без id
+        path = response.request.url[len(self.url.strip('/')):].split('?')[0].strip('/')
+        endpoint = path.split('/')[0] or '/'
+        method = response.request.method
+        REQUEST_SECONDS.observe(response.elapsed.total_seconds(), method=method, endpoint=endpoint)
+        REQUESTS.inc(method=method, endpoint=endpoint, status=response.status_code)
+
+    @property
+    def session_token(self):
+        return self.session.headers.get('Session-Token')
+
+    def renew_session(self):
+        # старый токен не должен уходить в initSession вместе с заголовками сессии
+        self.session.headers.pop('Session-Token', None)
+        self.session.headers['Session-Token'] = self._init_session(
+            self._apptoken, self._auth, self._user_agent, use_headers=self._use_headers)
+
+
+def is_session_error(error):
+    return any(key in str(error) for key in _SESSION_ERRORS)
+
+
+class GLPISessionManager:
+    """Одна авторизованная сессия GLPI на весь прогон вместо ``connect`` на каждую заявку.
+
+    Сессия открывается при первом запросе, при истёкшем или отозванном токене обновляется
+    и запрос повторяется один раз; ``close`` завершает сессию и закрывает соединения.
+    Потокобезопасен: этапы конвейера создают заявки из нескольких потоков.
+
+    .. code::
+
+        >>> with GLPISessionManager() as glpi:
+        >>>     glpi.add("Ticket", {"name": "..."})
+    """
+
+    def __init__(self, url=GLPI_URL, apptoken=GLPI_APP_TOKEN, auth=GLPI_USER_TOKEN, pool_size=GLPI_POOL_SIZE):
+        self.url = url
+        self.apptoken = apptoken
+        self.auth = auth
+        self.pool_size = pool_size
+        self.renewals = 0
+        self._glpi = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        with self._lock:
+            if self._glpi is None:
+                self._glpi = PooledGLPI(self.url, self.apptoken, self.auth, self.pool_size)
+                logger.info("GLPI session opened")
+            return self._glpi
+
+    def _renew(self, stale_token):
+        with self._lock:
+            # другой поток мог уже обновить сессию, пока этот ждал блокировку
+            if self._glpi.session_token == stale_token:
+                self._glpi.renew_session()
+                self.renewals += 1
+                SESSION_RENEWALS.inc()
+                logger.warning("GLPI session token rejected, session renewed")
+
+    def call(self, method, *args, **kwargs):
+        glpi = self._client()
+        token = glpi.session_token
+        try:
+            return getattr(glpi, method)(*args, **kwargs)
+        except GLPIError as e:
+            if not is_session_error(e):
+                raise
+            self._renew(token)
+            return getattr(glpi, method)(*args, **kwargs)
+
+    def add(self, itemtype, *items):
+        return self.call('add', itemtype, *items)
+
+    def close(self):
+        with self._lock:
+            glpi, self._glpi = self._glpi, None
+        if glpi is None:
+            return
+        try:
+            glpi.kill_session()
+        except GLPIError as e:
+            logger.warning(f"GLPI killSession failed: {e}")
+        finally:
+            glpi.session.close()
+            logger.info("GLPI session closed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,77 @@
+import logging
+
+import requests
+
+from config import INFERENCE_DAEMON_URL, INFERENCE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceError(Exception):
+    """Сервис инференса недоступен или вернул ошибку."""
+
+
+class InferenceClient:
+    """Клиент inference_daemon: распознавание и извлечение данных на прогретых моделях сервиса.
+
+    Не импортирует torch и модели, поэтому планировщик стартует сразу.
+
+    .. code::
+
+        >>> client = InferenceClient()
+        >>> if client.available():
+        >>>     for text, claim in client.analyze(["/app/downloaded_audio/msg0001.wav"]):
+        >>>         print(text, claim)
+    """
+
+    def __init__(self, url=INFERENCE_DAEMON_URL, timeout=INFERENCE_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def health(self):
+        response = self.session.get(f"{self.url}/health", timeout=2)
+        response.raise_for_status()
+        return response.json()
+
+    def available(self):
+        try:
+            return self.health()["status"] in ("ok", "loading")
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.info(f"Inference daemon at {self.url} is not available: {e}")
+            return False
+
+    def _post(self, path, payload):
+        try:
+            response = self.session.post(f"{self.url}/{path}", json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise InferenceError(f"{path}: {e}") from e
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.status_code != 200:
+            raise InferenceError(f"{path}: HTTP {response.status_code}: {body.get('error', response.text)}")
+        return body
+
+    def metrics_snapshot(self):
+        """``metrics.snapshot`` сервиса: распознавание и LLM, выполненные в нём."""
+        try:
+            response = self.session.get(f"{self.url}/snapshot", timeout=5)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise InferenceError(f"snapshot: {e}") from e
+
+    def analyze(self, paths):
+        """(текст, данные заявки) для каждого файла; пустой текст – речь не распознана."""
+        return [(r["text"], r["claim"]) for r in self._post("analyze", {"paths": paths})["results"]]
+
+    def transcribe(self, paths):
+        return self._post("transcribe", {"paths": paths})["texts"]
+
+    def extract(self, texts):
+        return self._post("extract", {"texts": texts})["claims"]
+
+    def close(self):
+        self.session.close()
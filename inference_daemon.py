@@ -0,0 +1,195 @@
+"""Локальный сервис инференса: держит модели Whisper и LLM прогретыми между запусками планировщика.
+
+HTTP на localhost, JSON в обе стороны:
+
+* ``GET /health`` – состояние и размер очереди;
+* ``GET /metrics`` – метрики распознавания и LLM в формате Prometheus;
+* ``GET /snapshot`` – те же метрики в JSON (``metrics.snapshot``) для сводки запуска планировщика;
+* ``POST /analyze`` ``{"paths": [...]}`` – распознавание и извлечение данных,
+  ``{"results": [{"text": ..., "claim": ...}, ...]}``;
+* ``POST /transcribe`` ``{"paths": [...]}`` – только распознавание, ``{"texts": [...]}``;
+* ``POST /extract`` ``{"texts": [...]}`` – только извлечение данных, ``{"claims": [...]}``.
+
+Пути – к файлам на локальном диске этого хоста. Задания выполняются по очереди одним потоком,
+владеющим моделями; если очередь (INFERENCE_QUEUE_SIZE) заполнена, сервис отвечает 503.
+
+.. code::
+
+    python inference_daemon.py
+"""
+import json
+import logging
+import queue
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+from config import INFERENCE_DAEMON_HOST, INFERENCE_DAEMON_PORT, INFERENCE_QUEUE_SIZE, INFERENCE_TIMEOUT
+from logger import setup_logger
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = metrics.gauge("gse_inference_queue_depth", "Заданий в очереди сервиса инференса")
+JOB_SECONDS = metrics.histogram("gse_inference_job_seconds", "Выполнение задания сервисом инференса, с", ("kind",))
+JOB_ERRORS = metrics.counter("gse_inference_job_errors_total", "Задания, завершившиеся ошибкой", ("kind",))
+
+
+class _Job:
+    def __init__(self, kind, payload):
+        self.kind = kind
+        self.payload = payload
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+def _analyze(payload):
+    import main
+    return {"results": [{"text": text, "claim": claim} for text, claim in main.analyze_batch(payload["paths"])]}
+
+
+def _transcribe(payload):
+    import main
+    return {"texts": main.transcribe_paths(payload["paths"])}
+
+
+def _extract(payload):
+    import main
+    return {"claims": main.extract_batch(payload["texts"])}
+
+
+HANDLERS = {"analyze": _analyze, "transcribe": _transcribe, "extract": _extract}
+
+
+class InferenceDaemon:
+    """Очередь заданий и поток, который выполняет их на загруженных один раз моделях."""
+
+    def __init__(self, host=INFERENCE_DAEMON_HOST, port=INFERENCE_DAEMON_PORT, queue_size=INFERENCE_QUEUE_SIZE):
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.ready = threading.Event()
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.inference = self
+        self._worker = threading.Thread(target=self._run, name="inference-worker", daemon=True)
+
+    def load_models(self):
+        import main
+        pool = main.start_asr_pool()
+        main.init_models(warm_asr=pool is None)
+        self.ready.set()
+        logger.info("Inference daemon: models loaded")
+
+    def submit(self, kind, payload, timeout=INFERENCE_TIMEOUT):
+        """Ставит задание в очередь и ждёт результат. ``queue.Full`` – очередь заполнена."""
+        job = _Job(kind, payload)
+        self.jobs.put_nowait(job)
+        QUEUE_DEPTH.set(self.jobs.qsize())
+        if not job.done.wait(timeout):
+            raise TimeoutError(f"{kind} job did not finish in {timeout:.0f} s")
+        if job.error:
+            raise RuntimeError(job.error)
+        return job.result
+
+    def _run(self):
+        try:
+            self.load_models()
+        except Exception:
+            # задания всё равно выполняются: main загрузит модели при первом обращении
+            logger.exception("Inference daemon: model preload failed")
+        while True:
+            job = self.jobs.get()
+            QUEUE_DEPTH.set(self.jobs.qsize())
+            if job is None:
+                break
+            try:
+                with JOB_SECONDS.time(kind=job.kind):
+                    job.result = HANDLERS[job.kind](job.payload)
+            except Exception as e:
+                logger.exception(f"Inference daemon: {job.kind} job failed")
+                JOB_ERRORS.inc(kind=job.kind)
+                job.error = str(e)
+            finally:
+                job.done.set()
+
+    def serve_forever(self):
+        self._worker.start()
+        host, port = self.server.server_address[:2]
+        logger.info(f"Inference daemon listening on http://{host}:{port}")
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.jobs.put(None)
+        self._worker.join()
+        import main
+        main.stop_asr_pool()
+        logger.info("Inference daemon stopped")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        daemon = self.server.inference
+        if self.path == "/metrics":
+            data = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if self.path == "/snapshot":
+            self._reply(200, metrics.snapshot())
+            return
+        if self.path != "/health":
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+        self._reply(200, {"status": "ok" if daemon.ready.is_set() else "loading", "queued": daemon.jobs.qsize()})
+
+    def do_POST(self):
+        kind = self.path.strip("/")
+        if kind not in HANDLERS:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError as e:
+            self._reply(400, {"error": f"invalid JSON: {e}"})
+            return
+        try:
+            self._reply(200, self.server.inference.submit(kind, payload))
+        except queue.Full:
+            self._reply(503, {"error": "queue is full"})
+        except TimeoutError as e:
+            self._reply(504, {"error": str(e)})
+        except Exception as e:
+            self._reply(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def main():
+    setup_logger()
+    daemon = InferenceDaemon()
+    # SIGTERM (docker stop) – как Ctrl+C: serve_forever завершается, модели и пул закрываются
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=daemon.server.shutdown).start())
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Состояние обработки голосовых сообщений в SQLite (WAL).
+
+Для каждого файла хранится последний пройденный этап, распознанный текст, извлечённые данные,
+id заявки, время этапов и число попыток. Повторный запуск продолжает файл с того этапа, на котором
+он остановился: например, после ошибки GLPI не запускаются заново Whisper и LLM.
+
+.. code::
+
+    python job_store.py import-log processed_files.log   # перенести старый журнал
+    python job_store.py stats
+    python job_store.py show msg0001.wav
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import JOB_STORE_PATH, PROCESSED_FILES_LOG
+
+logger = logging.getLogger(__name__)
+
+# Этапы в порядке прохождения; stage в таблице – последний успешно пройденный
+STAGES = ("new", "transcribed", "extracted", "submitted", "archived")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    filename TEXT PRIMARY KEY,
+    stage TEXT NOT NULL DEFAULT 'new',
+    metadata_json TEXT,
+    transcript TEXT,
+    claim_json TEXT,
+    ticket_id INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    timings_json TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage, updated_at);
+"""
+
+
+def stage_reached(job, stage):
+    """Пройден ли файлом этап ``stage`` (``job`` – запись JobStore.get или None)."""
+    return job is not None and STAGES.index(job["stage"]) >= STAGES.index(stage)
+
+
+class JobStore:
+    """Журнал заданий в SQLite. Одно соединение на процесс, операции сериализуются блокировкой,
+    поэтому хранилище можно использовать из потоков конвейера."""
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, filename):
+        rows = self._execute("SELECT * FROM jobs WHERE filename = ?", (filename,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["metadata"] = json.loads(job.pop("metadata_json") or "null")
+        job["claim"] = json.loads(job.pop("claim_json") or "null")
+        job["timings"] = json.loads(job.pop("timings_json"))
+        return job
+
+    def finished(self, filenames):
+        """Множество файлов из ``filenames``, уже полностью обработанных (заархивированных)."""
+        filenames = list(filenames)
+        done = set()
+        for start in range(0, len(filenames), 500):  # ограничение SQLite на число параметров
+            chunk = filenames[start:start + 500]
+            rows = self._execute(
+                f"SELECT filename FROM jobs WHERE stage = 'archived' AND filename IN ({','.join('?' * len(chunk))})",
+                chunk)
+            done.update(row["filename"] for row in rows)
+        return done
+
+    def start(self, filename, metadata=None):
+        """Начало очередной попытки обработки файла; возвращает его запись."""
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (filename, metadata_json, attempts, created_at, updated_at) VALUES (?, ?, 1, ?, ?) "
+            "ON CONFLICT (filename) DO UPDATE SET attempts = attempts + 1, error = NULL, updated_at = excluded.updated_at,"
+            " metadata_json = COALESCE(excluded.metadata_json, metadata_json)",
+            (filename, json.dumps(metadata, ensure_ascii=False) if metadata else None, now, now))
+        return self.get(filename)
+
+    def checkpoint(self, filename, stage, seconds=None, step=None, transcript=None, claim=None, ticket_id=None):
+        """Отмечает этап ``stage`` пройденным и сохраняет его результат и длительность шага конвейера
+        ``step`` (по умолчанию – ``stage``)."""
+        with self._lock:
+            row = self._conn.execute("SELECT timings_json FROM jobs WHERE filename = ?", (filename,)).fetchone()
+            timings = json.loads(row["timings_json"]) if row else {}
+            if seconds is not None:
+                timings[step or stage] = round(seconds, 3)
+            self._conn.execute(
+                "UPDATE jobs SET stage = ?, error = NULL, timings_json = ?, updated_at = ?,"
+                " transcript = COALESCE(?, transcript), claim_json = COALESCE(?, claim_json),"
+                " ticket_id = COALESCE(?, ticket_id) WHERE filename = ?",
+                (stage, json.dumps(timings), time.time(), transcript,
+                 json.dumps(claim, ensure_ascii=False) if claim is not None else None, ticket_id, filename))
+
+    def fail(self, filename, stage, error):
+        """Ошибка на этапе ``stage``: этап файла не меняется, следующий запуск начнёт с него."""
+        self._execute("UPDATE jobs SET error = ?, updated_at = ? WHERE filename = ?",
+                      (f"{stage}: {error}", time.time(), filename))
+
+    def is_empty(self):
+        return not self._execute("SELECT 1 FROM jobs LIMIT 1")
+
+    def import_log(self, path=PROCESSED_FILES_LOG):
+        """Переносит имена из старого processed_files.log как полностью обработанные; возвращает число новых."""
+        with open(path, "r") as f:
+            filenames = sorted({line.strip() for line in f if line.strip()})
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (filename, stage, created_at, updated_at) VALUES (?, 'archived', ?, ?)",
+                [(filename, now, now) for filename in filenames])
+            self._conn.execute("COMMIT")
+            imported = self._conn.total_changes - before
+        logger.info(f"Imported {imported} of {len(filenames)} files from {path}")
+        return imported
+
+    def stats(self):
+        rows = self._execute("SELECT stage, COUNT(*) AS files, SUM(error IS NOT NULL) AS failed FROM jobs GROUP BY stage")
+        return {row["stage"]: {"files": row["files"], "failed": row["failed"]} for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_store(path=JOB_STORE_PATH, legacy_log=PROCESSED_FILES_LOG):
+    """JobStore; при первом открытии в него переносится старый processed_files.log,
+    чтобы уже обработанные файлы не получили повторные заявки."""
+    store = JobStore(path)
+    if store.is_empty() and legacy_log and os.path.exists(legacy_log):
+        store.import_log(legacy_log)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Журнал обработки голосовых сообщений")
+    parser.add_argument("--db", default=JOB_STORE_PATH, help="файл SQLite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import-log", help="перенести processed_files.log")
+    import_parser.add_argument("path", nargs="?", default=PROCESSED_FILES_LOG)
+
+    commands.add_parser("stats", help="число файлов по этапам")
+
+    show_parser = commands.add_parser("show", help="состояние файла")
+    show_parser.add_argument("filename")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    store = JobStore(args.db)
+    try:
+        if args.command == "import-log":
+            print(store.import_log(args.path))
+        elif args.command == "stats":
+            for stage, s in store.stats().items():
+                print(f"{stage:<12} {s['files']:>8} files, {s['failed']} with errors")
+        elif args.command == "show":
+            job = store.get(args.filename)
+            if job is None:
+                raise SystemExit(f"{args.filename}: not found")
+            print(json.dumps(job, ensure_ascii=False, indent=2))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,82 +1,314 @@
 import os
 import traceback
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from asr import transcribe_audio
-from nlu import load_llm_model, parse_voice_claim
+from asr import stream_layout, transcribe_cascade, transcribe_many, transcribe_stream, warmup
+from autotune import max_model_copies, resolve_asr_settings
+from nlu import (RULES_MIN_CONFIDENCE, ClaimCache, PromptPrefixCache, extract_data_with_rules, load_draft_model,
+                 load_llm_model, load_llm_model_for_cpu, parse_voice_claim, parse_voice_claims)
 from config import *
-from glpi_api import connect
+from tickets import create_ticket
+import metrics
 import logging
 
 logger = logging.getLogger(__name__)
 
+BATCH_SECONDS = metrics.histogram("gse_inference_batch_seconds", "Распознавание или извлечение данных для батча, с",
+                                  ("step",))
+BATCH_FILES = metrics.histogram("gse_inference_batch_files", "Файлов или текстов в батче", ("step",),
+                                buckets=(1, 2, 4, 8, 16, 32, 64))
+FILE_ERRORS = metrics.counter("gse_inference_errors_total", "Файлы, не обработанные из-за ошибки", ("step",))
+
 # Инициализация моделей при старте
 tokenizer, model = None, None
+prefix_cache = None
+draft_model = None
+claim_cache = None
+asr_pool = None
+asr_warm = False
+asr_config = None
+
+
+def get_asr_settings():
+    """compute_type и раскладка потоков ASR: из config.py или подобранные autotune для этого хоста.
+
+    autotune замеряет реплики (num_workers) одной модели в процессе, так подобранная раскладка
+    и применяется: ``replicas`` реплик по ``threads_per_worker`` потоков. Пул процессов
+    (``workers``) задаётся только явно через ASR_WORKERS и autotune не переопределяется.
+    """
+    global asr_config
+    if asr_config is None:
+        asr_config = {
+            "compute_type": COMPUTE_TYPE,
+            "cpu_threads": WHISPER_CPU_THREADS,
+            "workers": ASR_WORKERS,
+            "threads_per_worker": ASR_THREADS_PER_WORKER,
+            "replicas": None,
+        }
+        if ASR_AUTOTUNE and DEVICE == "cpu":
+            try:
+                tuned = resolve_asr_settings(WHISPER_MODEL_PATH, AUTOTUNE_FILE, AUTOTUNE_CLIP)
+                asr_config["compute_type"] = tuned["compute_type"]
+                if ASR_WORKERS <= 1:
+                    asr_config.update(
+                        cpu_threads=tuned["workers"] * tuned["threads_per_worker"],
+                        replicas=tuned["workers"],
+                    )
+            except Exception as e:
+                logger.error(f"ASR autotune failed, using config.py settings: {e}")
+        logger.info(f"ASR settings: {asr_config}")
+    return asr_config
 
 
-def init_models():
-    global tokenizer, model
+def init_models(warm_asr=True):
+    global tokenizer, model, prefix_cache, draft_model, claim_cache, asr_warm
     if tokenizer is None or model is None:
         logger.info("Initializing ML models...")
-        tokenizer, model = load_llm_model(LLM_MODEL_NAME)
+        if LLM_QUANTIZED:
+            tokenizer, model = load_llm_model_for_cpu(LLM_MODEL_NAME, LLM_QUANTIZED_DIR)
+        else:
+            tokenizer, model = load_llm_model(LLM_MODEL_NAME)
+        if LLM_PREFIX_CACHE:
+            try:
+                prefix_cache = PromptPrefixCache(tokenizer, model)
+            except ValueError as e:
+                logger.warning(f"Prompt prefix cache disabled: {e}")
+        if LLM_DRAFT_MODEL_NAME:
+            draft_model = load_draft_model(LLM_DRAFT_MODEL_NAME, tokenizer,
+                                           LLM_DRAFT_QUANTIZED_DIR if LLM_QUANTIZED else None)
+        if CLAIM_CACHE_MAX_MB > 0:
+            # квантизованная модель может отвечать иначе, чем исходная, – у них разные записи
+            claim_cache = ClaimCache(CLAIM_CACHE_DIR, LLM_MODEL_NAME + (":int8" if LLM_QUANTIZED else ""),
+                                     CLAIM_CACHE_MAX_MB * 2 ** 20, CLAIM_CACHE_TTL_HOURS * 3600,
+                                     CLAIM_CACHE_MEMORY_ENTRIES)
+    if warm_asr and not asr_warm:
+        asr_warm = True
+        settings = get_asr_settings()
+        # прогреваем ту раскладку модели, которой будет распознавать выбранный режим
+        if ASR_CASCADE_ENABLED:
+            warmup(WHISPER_MODEL_PATH, DEVICE, settings["compute_type"], settings["cpu_threads"])
+            warmup(ASR_CASCADE_DRAFT_MODEL, DEVICE, settings["compute_type"], settings["cpu_threads"])
+        elif ASR_BATCH_SIZE > 1:
+            warmup(WHISPER_MODEL_PATH, DEVICE, settings["compute_type"], settings["cpu_threads"])
+        else:
+            warmup(WHISPER_MODEL_PATH, DEVICE, settings["compute_type"],
+                   *stream_layout(settings["cpu_threads"], settings["replicas"]))
+
+
+def cascade_settings():
+    """Параметры каскада для transcribe_cascade или None, если каскад выключен."""
+    if not ASR_CASCADE_ENABLED:
+        return None
+    return {
+        "draft_model_path": ASR_CASCADE_DRAFT_MODEL,
+        "avg_logprob_threshold": ASR_ESCALATE_AVG_LOGPROB,
+        "compression_ratio_threshold": ASR_ESCALATE_COMPRESSION_RATIO,
+        "no_speech_threshold": ASR_ESCALATE_NO_SPEECH_PROB,
+    }
+
+
+def is_hopeless_segment(segment):
+    return (segment.no_speech_prob > ASR_ABANDON_NO_SPEECH_PROB
+            or segment.avg_logprob < ASR_ABANDON_AVG_LOGPROB)
+
+
+def transcribe_with_hints(audio_path):
+    """Потоковое распознавание с ранним отказом от шума.
+
+    Возвращает текст и уверенно найденные правилами поля (``rule_hints`` по готовому тексту: данные
+    заявки извлекаются только после полного распознавания). Если первые ASR_ABANDON_SEGMENTS
+    сегментов безнадёжны, распознавание прерывается и возвращается пустой текст.
+    """
+    parts, hopeless = [], 0
+    settings = get_asr_settings()
+    segments = transcribe_stream(audio_path, WHISPER_MODEL_PATH, DEVICE, settings["compute_type"],
+                                 settings["cpu_threads"], replicas=settings["replicas"])
+    for index, segment in enumerate(segments):
+        if index < ASR_ABANDON_SEGMENTS and is_hopeless_segment(segment):
+            hopeless += 1
+            if hopeless == ASR_ABANDON_SEGMENTS:
+                logger.warning(f"Abandoning {audio_path}: first {hopeless} segments look like noise")
+                segments.close()
+                return "", {}
+        parts.append(segment.text)
+
+    recognized_text = " ".join(parts).strip()
+    logger.info(f"Recognized text: {recognized_text}")
+    return recognized_text, rule_hints(recognized_text)
+
+
+def rule_hints(text):
+    """Поля, найденные правилами с уверенностью не ниже RULES_MIN_CONFIDENCE."""
+    data, confidence = extract_data_with_rules(text)
+    return {field: value for field, value in data.items()
+            if value and confidence.get(field, 0.0) >= RULES_MIN_CONFIDENCE}
+
+
+def merge_hints(claim_data, hints):
+    """Заполняет пустые поля ответа LLM тем, что уверенно нашли правила (см. ``rule_hints``)."""
+    sources = claim_data.setdefault("field_sources", {})
+    for key in ("train_number", "wagon_number", "executor_name"):
+        if not claim_data.get(key) and hints.get(key):
+            claim_data[key] = hints[key]
+            sources[key] = "rules"
+    return claim_data
+
+
+def extract_claims(texts):
+    """Пакетное извлечение данных из нескольких текстов одним generate на LLM_BATCH_SIZE текстов."""
+    init_models(warm_asr=False)
+    return parse_voice_claims(texts, tokenizer, model, batch_size=LLM_BATCH_SIZE, prefix_cache=prefix_cache,
+                              draft_model=draft_model, claim_cache=claim_cache)
+
+
+def transcribe_file(audio_path):
+    """Распознавание одного файла каскадом или потоково; возвращает текст и уверенно найденные правилами поля."""
+    if ASR_CASCADE_ENABLED:
+        settings = get_asr_settings()
+        recognized_text, tier = transcribe_cascade(audio_path, model_path=WHISPER_MODEL_PATH, device=DEVICE,
+                                                   compute_type=settings["compute_type"],
+                                                   cpu_threads=settings["cpu_threads"], **cascade_settings())
+        logger.info(f"ASR tier for {os.path.basename(audio_path)}: {tier}")
+        return recognized_text, rule_hints(recognized_text)
+    return transcribe_with_hints(audio_path)
+
+
+def analyze_audio_file(audio_path, recognized_text=None, claim_data=None):
+    """Распознавание и извлечение данных одного файла без создания заявки.
+
+    Возвращает текст и данные заявки; если речь не распознана – пустой текст и ``None``.
+    """
+    init_models(warm_asr=recognized_text is None and asr_pool is None)
+
+    # Распознавание аудио (если текст не получен заранее батчем)
+    if recognized_text is None:
+        recognized_text, hints = transcribe_file(audio_path)
+    else:
+        hints = rule_hints(recognized_text)
+    if not recognized_text:
+        logger.error("No text recognized from audio")
+        return "", None
+
+    # Извлечение структурированных данных (если не извлечены заранее батчем)
+    if claim_data is None:
+        claim_data = parse_voice_claim(recognized_text, tokenizer, model, prefix_cache, draft_model,
+                                       claim_cache)
+    claim_data = merge_hints(claim_data, hints)
+    logger.info(f"Extracted data: {claim_data}")
+    return recognized_text, claim_data
 
 
-def generate_ticket_content(claim_data):
-    """Генерация содержимого заявки"""
-    return (
-        "Заявка создана через голосового помощника\n"
-        "#голосовой_помощник\n"
-        f"Поезд: {claim_data.get('train_number', 'N/A')}\n"
-        f"Вагон: {claim_data.get('wagon_number', 'N/A')}\n"
-        f"Серийный номер: {claim_data.get('wagon_sn', 'N/A')}\n"
-        f"Проблемы: {', '.join(claim_data.get('problems', []))}\n"
-        f"Заявитель: {claim_data.get('executor_name', 'аноним')}\n"
-        f"Номер звонящего: {claim_data.get('callerid', 'N/A')}\n"
-        f"Дата звонка: {claim_data.get('call_date', 'N/A')}"
-    )
+def start_asr_pool():
+    """Пул процессов ASR, если ASR_WORKERS больше одного. Каждый воркер загружает свою копию модели,
+    поэтому воркеров не больше, чем копий помещается в доступную память."""
+    global asr_pool
+    settings = get_asr_settings()
+    if asr_pool is None and settings["workers"] > 1:
+        from asr_pool import ASRWorkerPool
+        workers = settings["workers"]
+        copies = max_model_copies(WHISPER_MODEL_PATH)
+        if copies is None:
+            logger.warning(f"Cannot estimate memory for {WHISPER_MODEL_PATH}, starting {workers} ASR workers unchecked")
+        elif copies < workers:
+            logger.warning(f"Only {copies} copies of {WHISPER_MODEL_PATH} fit in available memory, "
+                           f"reducing ASR workers from {workers} to {copies}")
+            workers = copies
+        if workers > 1:
+            asr_pool = ASRWorkerPool(WHISPER_MODEL_PATH, DEVICE, settings["compute_type"], workers,
+                                     settings["threads_per_worker"], ASR_PIN_CPUS, cascade_settings())
+    return asr_pool
 
 
-def process_audio_file(audio_path, metadata=None):
-    init_models()
+def stop_asr_pool():
+    global asr_pool
+    if asr_pool is not None:
+        asr_pool.close()
+        asr_pool = None
 
+
+def transcribe_batch(paths):
+    """Тексты для paths пулом процессов или батчевым проходом; ``None`` – файл распознаётся поштучно."""
+    if asr_pool is not None:
+        return asr_pool.map(paths)
+    # одиночный файл тоже идёт батчевым проходом: так используется уже прогретая модель
+    if ASR_BATCH_SIZE > 1 and not ASR_CASCADE_ENABLED:
+        try:
+            settings = get_asr_settings()
+            return transcribe_many(paths, WHISPER_MODEL_PATH, DEVICE, settings["compute_type"],
+                                   settings["cpu_threads"], batch_size=ASR_BATCH_SIZE)
+        except Exception as e:
+            logger.error(f"Batch transcription failed, falling back to per-file: {e}")
+    return [None] * len(paths)
+
+
+def transcribe_paths(paths):
+    """Тексты для paths: батчем, где возможно, остальные – поштучно через transcribe_file,
+    параллельно на репликах модели, если autotune их подобрал."""
+    init_models(warm_asr=asr_pool is None)
+    BATCH_FILES.observe(len(paths), step="transcribe")
+    with BATCH_SECONDS.time(step="transcribe"):
+        texts = transcribe_batch(paths)
+        pending = [i for i, text in enumerate(texts) if text is None]
+        if pending:
+            with ThreadPoolExecutor(max_workers=get_asr_settings()["replicas"] or 1) as executor:
+                for i, text in zip(pending, executor.map(_transcribe_text, [paths[i] for i in pending])):
+                    texts[i] = text
+    return texts
+
+
+def _transcribe_text(path):
     try:
-        # Распознавание аудио
-        recognized_text = transcribe_audio(audio_path, WHISPER_MODEL_PATH, DEVICE, COMPUTE_TYPE)
-        if not recognized_text:
-            logger.error("No text recognized from audio")
-            return False
+        return transcribe_file(path)[0]
+    except Exception as e:
+        logger.error(f"Error transcribing {path}: {e}")
+        FILE_ERRORS.inc(step="transcribe")
+        return ""
 
-        # Извлечение структурированных данных
-        claim_data = parse_voice_claim(recognized_text, tokenizer, model)
-        logger.info(f"Extracted data: {claim_data}")
 
-        # Добавляем метаданные из txt файла в claim_data
-        if metadata:
-            claim_data.update({
-                'callerid': metadata.get('callerid', 'N/A'),
-                'origtime': metadata.get('origtime', 0),
-                'call_date': datetime.fromtimestamp(metadata.get('origtime', 0)).strftime('%Y-%m-%d %H:%M:%S')
-            })
+def extract_batch(texts):
+    """Данные заявок для распознанных texts: пакетное извлечение и поля, уверенно найденные правилами."""
+    BATCH_FILES.observe(len(texts), step="extract")
+    with BATCH_SECONDS.time(step="extract"):
+        claims = extract_claims(texts)
+    return [merge_hints(claim, rule_hints(text)) for claim, text in zip(claims, texts)]
+
+
+def analyze_batch(paths):
+    """(текст, данные заявки) для каждого файла: батчевое ASR, пакетное извлечение данных,
+    остальное – поштучно через analyze_audio_file. Ошибка одного файла даёт пустой текст."""
+    init_models(warm_asr=asr_pool is None)
+    texts = transcribe_batch(paths)
+
+    claims = [None] * len(paths)
+    batch = [i for i, text in enumerate(texts) if text]
+    if len(batch) > 1:
+        try:
+            for i, claim in zip(batch, extract_claims([texts[i] for i in batch])):
+                claims[i] = claim
+        except Exception as e:
+            logger.error(f"Batch extraction failed, falling back to per-file: {e}")
+
+    results = []
+    for path, text, claim in zip(paths, texts, claims):
+        try:
+            results.append(analyze_audio_file(path, recognized_text=text, claim_data=claim))
+        except Exception as e:
+            logger.error(f"Error analyzing {path}: {e}")
+            FILE_ERRORS.inc(step="analyze")
+            traceback.print_exc()
+            results.append(("", None))
+    return results
+
+
+def process_audio_file(audio_path, metadata=None, recognized_text=None, claim_data=None):
+    try:
+        recognized_text, claim_data = analyze_audio_file(audio_path, recognized_text, claim_data)
+        if not recognized_text:
+            return False
 
         # Создание заявки в GLPI
-        with connect(GLPI_URL, GLPI_APP_TOKEN, GLPI_USER_TOKEN) as glpi:
-            ticket_data = {
-                "name": f"Заявка от {claim_data.get('executor_name', 'анонима')}",
-                "content": generate_ticket_content(claim_data),
-                "urgency": 4,
-                "impact": 4,
-                "priority": 4,
-                "type": 1,
-                "requesttypes_id": 8,
-                "itilcategories_id": 39,
-                "entities_id": 16,
-                "_users_id_observer": [22],
-            }
-
-            result = glpi.add("Ticket", ticket_data)
-            ticket_id = result[0]['id']
-            logger.info(f"Ticket #{ticket_id} created successfully")
-            return True
+        create_ticket(claim_data, metadata)
+        return True
 
     except Exception as e:
         logger.error(f"Error processing {audio_path}: {e}")
@@ -90,8 +322,3 @@ def process_audio_file(audio_path, metadata=None):
                 logger.info(f"Deleted audio file: {audio_path}")
         except Exception as e:
             logger.error(f"Error deleting audio file {audio_path}: {e}")
-
-
-if __name__ == "__main__":
-    # Для ручного тестирования
-    process_audio_file("msg0003.wav")
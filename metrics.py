@@ -0,0 +1,383 @@
+"""Метрики обработки: счётчики, значения и гистограммы в формате Prometheus.
+
+Модули объявляют метрики при импорте и обновляют их по ходу работы; ``render`` отдаёт их
+в текстовом формате Prometheus (``GET /metrics`` у ``MetricsServer`` и ``inference_daemon``),
+``summary`` – JSON-сводку, которую планировщик пишет в ``METRICS_SUMMARY_DIR`` после каждого запуска.
+
+Метрики живут в памяти процесса. Процессы пула ASR возвращают прирост своих метрик вместе
+с результатом (``delta``/``merge``), а метрики ``inference_daemon`` планировщик забирает
+через ``GET /snapshot`` сервиса и добавляет в сводку запуска отдельным разделом.
+
+.. code::
+
+    >>> FILES = metrics.counter("gse_files_total", "Обработано файлов", ("result",))
+    >>> FILES.inc(result="ok")
+    >>> with metrics.histogram("gse_step_seconds", "Длительность шага", ("step",)).time(step="asr"):
+    >>>     ...
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_HOST, METRICS_PORT, METRICS_SUMMARY_DIR
+
+logger = logging.getLogger(__name__)
+
+# Границы по умолчанию (секунды): от быстрых HTTP-запросов до распознавания длинной записи
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def export(self):
+        """Описание и значения метрики в виде, пригодном для JSON (см. ``Registry.snapshot``)."""
+        return {"kind": self.kind, "help": self.documentation, "labels": list(self.labelnames),
+                "series": [[list(key), value] for key, value in self.snapshot().items()]}
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _add(self, key, value):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def _samples(self, snapshot):
+        for key, value in snapshot.items():
+            yield self.name, key, (), value
+
+
+class Gauge(_Metric):
+    """Текущее значение, например, глубина очереди."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self, snapshot):
+        for key, value in snapshot.items():
+            yield self.name, key, (), value
+
+
+class Histogram(_Metric):
+    """Распределение наблюдений по корзинам ``buckets`` с их суммой и числом."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Наблюдает длительность блока ``with`` в секундах (в том числе завершившегося исключением)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _copy(value):
+        return {"counts": list(value["counts"]), "sum": value["sum"], "count": value["count"]}
+
+    def export(self):
+        return dict(super().export(), buckets=list(self.buckets[:-1]))
+
+    def _add(self, key, state):
+        with self._lock:
+            current = self._values.get(key)
+            if current is None:
+                current = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            current["counts"] = [a + b for a, b in zip(current["counts"], state["counts"])]
+            current["sum"] += state["sum"]
+            current["count"] += state["count"]
+
+    def _samples(self, snapshot):
+        for key, state in snapshot.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                yield f"{self.name}_bucket", key, (("le", _format_value(bound)),), cumulative
+            yield f"{self.name}_sum", key, (), state["sum"]
+            yield f"{self.name}_count", key, (), state["count"]
+
+
+class Registry:
+    """Набор метрик процесса. Повторное объявление метрики с тем же именем возвращает существующую."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} is already registered as {metric.kind} {metric.labelnames}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def snapshot(self):
+        """Описание и значения всех метрик (JSON-совместимо) – точка отсчёта для ``summary``,
+        ``delta`` и ``merge``."""
+        return {metric.name: metric.export() for metric in self.metrics()}
+
+    def merge(self, exported):
+        """Добавляет счётчики и гистограммы из ``exported`` (обычно ``delta`` другого процесса) к своим."""
+        for name, data in exported.items():
+            labels = tuple(data["labels"])
+            if data["kind"] == "counter":
+                metric = self.counter(name, data["help"], labels)
+            elif data["kind"] == "histogram":
+                metric = self.histogram(name, data["help"], labels, data["buckets"])
+            else:
+                continue  # текущее значение gauge другого процесса к своему не прибавить
+            for key, value in data["series"]:
+                metric._add(tuple(key), value)
+
+    def render(self):
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)."""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric._samples(metric.snapshot()):
+                lines.append(f"{name}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, since=None):
+        return summarize(since, self.snapshot())
+
+
+def _quantile(buckets, state, q):
+    """Оценка квантиля по корзинам ``buckets`` (без +Inf) с линейной интерполяцией внутри корзины."""
+    if not state["count"]:
+        return 0.0
+    rank = q * state["count"]
+    cumulative, lower = 0, 0.0
+    for bound, count in zip(list(buckets) + [math.inf], state["counts"]):
+        if count and cumulative + count >= rank:
+            if bound == math.inf:
+                return lower
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return lower
+
+
+def _diff(kind, value, base):
+    if kind == "counter":
+        return value - (base or 0)
+    if base is None:
+        return value
+    return {"counts": [a - b for a, b in zip(value["counts"], base["counts"])],
+            "sum": value["sum"] - base["sum"], "count": value["count"] - base["count"]}
+
+
+def delta(before, after):
+    """Прирост счётчиков и гистограмм между двумя ``snapshot`` (без gauge и пустых рядов)."""
+    result = {}
+    for name, data in after.items():
+        if data["kind"] == "gauge":
+            continue
+        base = {tuple(key): value for key, value in (before or {}).get(name, {}).get("series", [])}
+        series = []
+        for key, value in data["series"]:
+            change = _diff(data["kind"], value, base.get(tuple(key)))
+            if (change["count"] if data["kind"] == "histogram" else change):
+                series.append([key, change])
+        if series:
+            result[name] = dict(data, series=series)
+    return result
+
+
+def summarize(before, after):
+    """JSON-сводка между двумя ``snapshot``: счётчики и гистограммы – прирост с ``before``, значения
+    (gauge) – из ``after``. Для гистограмм – число, сумма, среднее, p50 и p95."""
+    changed = delta(before, after)
+    gauges = {name: data for name, data in after.items() if data["kind"] == "gauge"}
+    result = {}
+    for name, data in sorted({**changed, **gauges}.items()):
+        series = {}
+        for key, value in data["series"]:
+            label = ",".join(f"{label}={v}" for label, v in zip(data["labels"], key)) or "total"
+            if data["kind"] == "histogram":
+                value = {"count": value["count"], "sum": round(value["sum"], 3),
+                         "avg": round(value["sum"] / value["count"], 3),
+                         "p50": round(_quantile(data["buckets"], value, 0.5), 3),
+                         "p95": round(_quantile(data["buckets"], value, 0.95), 3)}
+            series[label] = value
+        if series:
+            result[name] = series
+    return result
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+
+def snapshot():
+    return REGISTRY.snapshot()
+
+
+def merge(exported):
+    REGISTRY.merge(exported)
+
+
+def render():
+    return REGISTRY.render()
+
+
+def summary(since=None):
+    return REGISTRY.summary(since)
+
+
+def write_summary(since=None, directory=METRICS_SUMMARY_DIR, **extra):
+    """Сохраняет ``summary(since)`` (и поля ``extra``) в ``directory``/metrics_<время>.json; возвращает путь."""
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.now()
+    path = os.path.join(directory, f"metrics_{now.strftime('%Y%m%d_%H%M%S')}.json")
+    data = dict(extra, finished_at=now.isoformat(timespec="seconds"), metrics=summary(since))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return path
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class MetricsServer:
+    """``GET /metrics`` на ``host:port`` в фоновом потоке.
+
+    .. code::
+
+        >>> server = MetricsServer().start()
+        >>> ...
+        >>> server.stop()
+    """
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        host, port = self.server.server_address[:2]
+        logger.info(f"Metrics available at http://{host}:{port}/metrics")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
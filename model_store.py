@@ -0,0 +1,255 @@
+"""Локальное хранилище моделей Whisper в формате CTranslate2.
+
+Модели заранее скачиваются (или конвертируются из checkpoint'а transformers) в версионированные
+каталоги ``<MODEL_STORE_DIR>/whisper/<имя>/<версия>/`` с ``manifest.json`` – контрольными суммами
+всех файлов. Текущая версия записана в ``<имя>/CURRENT``. ``asr`` загружает модели только отсюда,
+без обращения к сети, поэтому холодный старт контейнера не зависит от Hugging Face.
+
+.. code::
+
+    python model_store.py fetch large                          # готовая CT2-модель Systran
+    python model_store.py fetch large-v3 --convert openai/whisper-large-v3 --quantization int8
+    python model_store.py list
+    python model_store.py verify
+    python model_store.py prune --keep 2
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+from config import MODEL_STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+CURRENT = "CURRENT"
+
+
+class ModelStoreError(Exception):
+    """Ошибка хранилища моделей: модель не найдена или повреждена."""
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _model_dir(name, store_dir=MODEL_STORE_DIR):
+    return os.path.join(store_dir, "whisper", name.replace("/", "--"))
+
+
+def _read_manifest(version_dir):
+    with open(os.path.join(version_dir, MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_version(name, store_dir=MODEL_STORE_DIR):
+    try:
+        with open(os.path.join(_model_dir(name, store_dir), CURRENT), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def set_current(name, version, store_dir=MODEL_STORE_DIR):
+    model_dir = _model_dir(name, store_dir)
+    if not os.path.isdir(os.path.join(model_dir, version)):
+        raise ModelStoreError(f"version {version} of {name} not found")
+    tmp_path = os.path.join(model_dir, f"{CURRENT}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(model_dir, CURRENT))
+
+
+def fetch(name, convert_from=None, quantization=None, version=None, store_dir=MODEL_STORE_DIR, make_current=True):
+    """Скачивает готовую CT2-модель ``name`` (или конвертирует ``convert_from``) в новую версию хранилища."""
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    model_dir = _model_dir(name, store_dir)
+    version_dir = os.path.join(model_dir, version)
+    if os.path.exists(version_dir):
+        raise ModelStoreError(f"version {version} of {name} already exists")
+    tmp_dir = f"{version_dir}.partial"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(model_dir, exist_ok=True)
+
+    try:
+        if convert_from:
+            from ctranslate2.converters import TransformersConverter
+
+            logger.info(f"Converting {convert_from} to CTranslate2 ({quantization or 'no quantization'})...")
+            TransformersConverter(convert_from, copy_files=["tokenizer.json", "preprocessor_config.json"]) \
+                .convert(tmp_dir, quantization=quantization)
+            source = convert_from
+        else:
+            from faster_whisper.utils import download_model
+
+            logger.info(f"Downloading {name}...")
+            download_model(name, output_dir=tmp_dir)
+            source = name
+            shutil.rmtree(os.path.join(tmp_dir, ".cache"), ignore_errors=True)
+
+        files = {}
+        for file_name in sorted(os.listdir(tmp_dir)):
+            path = os.path.join(tmp_dir, file_name)
+            if os.path.isfile(path):
+                files[file_name] = {"sha256": _sha256(path), "size": os.path.getsize(path)}
+        manifest = {
+            "name": name,
+            "version": version,
+            "source": source,
+            "quantization": quantization,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "files": files,
+        }
+        with open(os.path.join(tmp_dir, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.rename(tmp_dir, version_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    if make_current:
+        set_current(name, version, store_dir)
+    logger.info(f"Stored {name} version {version} in {version_dir}")
+    return version_dir
+
+
+def verify_version(version_dir, full=True):
+    """Проверяет файлы версии по манифесту. ``full=False`` – только размеры (быстро, для загрузки)."""
+    try:
+        manifest = _read_manifest(version_dir)
+    except (OSError, ValueError) as e:
+        return [f"{version_dir}: manifest unreadable: {e}"]
+
+    problems = []
+    for file_name, expected in manifest["files"].items():
+        path = os.path.join(version_dir, file_name)
+        if not os.path.isfile(path):
+            problems.append(f"{path}: missing")
+        elif os.path.getsize(path) != expected["size"]:
+            problems.append(f"{path}: size mismatch")
+        elif full and _sha256(path) != expected["sha256"]:
+            problems.append(f"{path}: checksum mismatch")
+    return problems
+
+
+def list_models(store_dir=MODEL_STORE_DIR):
+    """Все версии всех моделей хранилища."""
+    root = os.path.join(store_dir, "whisper")
+    entries = []
+    if not os.path.isdir(root):
+        return entries
+    for model_name in sorted(os.listdir(root)):
+        model_dir = os.path.join(root, model_name)
+        if not os.path.isdir(model_dir):
+            continue
+        name = model_name.replace("--", "/")
+        current = current_version(name, store_dir)
+        for version in sorted(os.listdir(model_dir)):
+            version_dir = os.path.join(model_dir, version)
+            if not os.path.isfile(os.path.join(version_dir, MANIFEST)):
+                continue
+            manifest = _read_manifest(version_dir)
+            entries.append({
+                "name": name,
+                "version": version,
+                "current": version == current,
+                "source": manifest.get("source"),
+                "quantization": manifest.get("quantization"),
+                "size": sum(f["size"] for f in manifest["files"].values()),
+                "path": version_dir,
+            })
+    return entries
+
+
+def prune(keep=2, name=None, store_dir=MODEL_STORE_DIR):
+    """Удаляет старые версии, оставляя ``keep`` последних и всегда – текущую. Возвращает удалённые пути."""
+    removed = []
+    by_name = {}
+    for entry in list_models(store_dir):
+        if name is None or entry["name"] == name:
+            by_name.setdefault(entry["name"], []).append(entry)
+    for entries in by_name.values():
+        for entry in sorted(entries, key=lambda e: e["version"], reverse=True)[keep:]:
+            if entry["current"]:
+                continue
+            shutil.rmtree(entry["path"])
+            removed.append(entry["path"])
+            logger.info(f"Pruned {entry['path']}")
+    return removed
+
+
+def resolve(name, store_dir=MODEL_STORE_DIR):
+    """Путь к текущей версии модели ``name``; ``None``, если её нет в хранилище."""
+    version = current_version(name, store_dir)
+    if version is None:
+        return None
+    version_dir = os.path.join(_model_dir(name, store_dir), version)
+    problems = verify_version(version_dir, full=False)
+    if problems:
+        raise ModelStoreError(f"model {name} version {version} is damaged: {'; '.join(problems)}")
+    return version_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальное хранилище моделей Whisper (CTranslate2)")
+    parser.add_argument("--store", default=MODEL_STORE_DIR, help="каталог хранилища")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = commands.add_parser("fetch", help="скачать или сконвертировать модель в новую версию")
+    fetch_parser.add_argument("name", help="имя модели, как в WHISPER_MODEL_PATH (large, small, ...)")
+    fetch_parser.add_argument("--convert", metavar="HF_ID", help="сконвертировать checkpoint transformers")
+    fetch_parser.add_argument("--quantization", help="квантизация при конвертации (int8, int8_float32, ...)")
+    fetch_parser.add_argument("--version", help="имя версии (по умолчанию – текущие дата и время)")
+    fetch_parser.add_argument("--no-current", action="store_true", help="не делать новую версию текущей")
+
+    commands.add_parser("list", help="показать модели и версии")
+
+    verify_parser = commands.add_parser("verify", help="проверить контрольные суммы")
+    verify_parser.add_argument("name", nargs="?")
+
+    prune_parser = commands.add_parser("prune", help="удалить старые версии")
+    prune_parser.add_argument("name", nargs="?")
+    prune_parser.add_argument("--keep", type=int, default=2)
+
+    use_parser = commands.add_parser("use", help="сделать версию текущей")
+    use_parser.add_argument("name")
+    use_parser.add_argument("version")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    if args.command == "fetch":
+        print(fetch(args.name, args.convert, args.quantization, args.version, args.store, not args.no_current))
+    elif args.command == "list":
+        for entry in list_models(args.store):
+            marker = "*" if entry["current"] else " "
+            print(f"{marker} {entry['name']:<20} {entry['version']:<18} {entry['size'] / 2 ** 20:>9.0f} MB  "
+                  f"{entry['source']} {entry['quantization'] or ''}")
+    elif args.command == "verify":
+        failed = False
+        for entry in list_models(args.store):
+            if args.name and entry["name"] != args.name:
+                continue
+            problems = verify_version(entry["path"])
+            failed = failed or bool(problems)
+            print(f"{entry['name']} {entry['version']}: {'OK' if not problems else 'FAILED'}")
+            for problem in problems:
+                print(f"  {problem}")
+        raise SystemExit(1 if failed else 0)
+    elif args.command == "prune":
+        for path in prune(args.keep, args.name, args.store):
+            print(f"removed {path}")
+    elif args.command == "use":
+        set_current(args.name, args.version, args.store)
+
+
+if __name__ == "__main__":
+    main()
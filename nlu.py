@@ -1,9 +1,20 @@
 # nlu.py – улучшенная версия с сохранёнными именами функций
+import copy
+import hashlib
 import json
+import os
 import re
+import shutil
 import logging
+import threading
+import time
+from collections import OrderedDict
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import transformers
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList
+
+import metrics
+from transcript_cache import DiskLRUCache
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +34,110 @@ def load_llm_model(model_name: str):
     return tok, model
 
 
+def quantize_llm_model(model_name: str, output_dir: str):
+    """Однократная динамическая int8-квантизация LLM для CPU; артефакт сохраняется в output_dir."""
+    logger.info("🧠 Квантизуем LLM %s в %s", model_name, output_dir)
+    started = time.perf_counter()
+    tok = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+    model.eval()
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    tmp_dir = f"{output_dir}.partial"
+    shutil.rmtree(tmp_dir, ignore_errors=True)  # остатки прерванной сборки
+    os.makedirs(tmp_dir)
+    torch.save(model, os.path.join(tmp_dir, "model.pt"))
+    tok.save_pretrained(tmp_dir)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "source": model_name,
+            "quantization": "dynamic-qint8",
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }, f, ensure_ascii=False, indent=2)
+    # os.replace не заменяет непустой каталог: старый артефакт сначала убираем в сторону
+    stale_dir = f"{output_dir}.stale"
+    shutil.rmtree(stale_dir, ignore_errors=True)
+    if os.path.exists(output_dir):
+        os.replace(output_dir, stale_dir)
+    os.replace(tmp_dir, output_dir)
+    shutil.rmtree(stale_dir, ignore_errors=True)
+    logger.info("✅ Квантизованная модель сохранена за %.0f с", time.perf_counter() - started)
+
+
+def _read_manifest(artifact_dir: str):
+    try:
+        with open(os.path.join(artifact_dir, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _artifact_is_current(manifest, model_name: str):
+    """Артефакт собран из model_name под установленные сейчас torch и transformers."""
+    return (manifest is not None and manifest.get("source") == model_name
+            and (manifest.get("torch"), manifest.get("transformers")) == (torch.__version__, transformers.__version__))
+
+
+def load_quantized_llm_model(artifact_dir: str):
+    """Загружает артефакт quantize_llm_model.
+
+    Через mmap с диска читаются только обычные тензоры (эмбеддинги, нормализации). Упакованные int8-веса
+    Linear при распаковке заново упаковываются в память процесса, поэтому они занимают анонимную память
+    в каждом процессе, а не общие страницы файла; выигрыш по памяти – от int8 вместо float32.
+    """
+    manifest = _read_manifest(artifact_dir)
+    if manifest is None:
+        raise RuntimeError(f"в {artifact_dir} нет manifest.json")
+    if not _artifact_is_current(manifest, manifest["source"]):
+        raise RuntimeError(f"артефакт собран под torch {manifest['torch']} / transformers "
+                           f"{manifest['transformers']}, пересоберите его")
+
+    logger.info("🧠 Загружаем квантизованную LLM: %s", artifact_dir)
+    tok = AutoTokenizer.from_pretrained(artifact_dir)
+    model = torch.load(os.path.join(artifact_dir, "model.pt"), mmap=True, weights_only=False)
+    model.eval()
+    if tok.pad_token is None:
+        tok.pad_token = tok.eos_token
+    logger.info("✅ Квантизованная модель загружена (%s)", manifest["source"])
+    return tok, model
+
+
+def load_llm_model_for_cpu(model_name: str, artifact_dir: str):
+    """На CPU – квантизованная копия модели, иначе – load_llm_model.
+
+    Копия создаётся при первом запуске и пересобирается, если она сделана из другой модели или под
+    другие версии torch/transformers (после их обновления), – иначе каждый запуск шёл бы на float32.
+    """
+    if torch.cuda.is_available():
+        return load_llm_model(model_name)
+    manifest = _read_manifest(artifact_dir)
+    if not _artifact_is_current(manifest, model_name):
+        if manifest is not None:
+            logger.info("🔁 Квантизованная модель в %s собрана из %s под torch %s / transformers %s, пересобираем",
+                        artifact_dir, manifest.get("source"), manifest.get("torch"), manifest.get("transformers"))
+        quantize_llm_model(model_name, artifact_dir)
+    try:
+        return load_quantized_llm_model(artifact_dir)
+    except Exception as e:
+        logger.warning("⚠️ Не удалось загрузить квантизованную модель (%s), используем исходную", e)
+        return load_llm_model(model_name)
+
+
+def load_draft_model(model_name: str, tokenizer, artifact_dir: str = None):
+    """Черновая модель для assisted decoding; ``None``, если её словарь не совпадает со словарём основной."""
+    if artifact_dir:
+        draft_tokenizer, draft_model = load_llm_model_for_cpu(model_name, artifact_dir)
+    else:
+        draft_tokenizer, draft_model = load_llm_model(model_name)
+    if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+        logger.warning("⚠️ Словарь %s не совпадает со словарём основной модели, assisted decoding выключен",
+                       model_name)
+        return None
+    return draft_model
+
+
 def extract_first_json(text: str):
     """extract_first_json – старое имя."""
     match = re.search(r'\{.*\}', text, flags=re.S)
@@ -34,59 +149,571 @@ def extract_first_json(text: str):
         return None
 
 
+_TRAIN_RE = re.compile(r"(?:поезд|train)\s*(?:№|#)?\s*(\d+)", re.I)
+_WAGON_RE = re.compile(r"(?:вагон|wagon)\s*(?:№|#)?\s*(\d{1,2})", re.I)
+_NAME_RE = re.compile(r"\b([А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)?)\b")
+_PROBLEM_RE = re.compile(
+    r"(?:проблема|не работает|сломан|отключ|пропадает|не ид[её]т)\s*[а-яёa-z0-9,\s\-]{3,}", re.I
+)
+
+
 def extract_data_from_text_fallback(text: str):
     """extract_data_from_text_fallback – старое имя."""
     data = {}
 
     # поезд
-    train_match = re.search(r"(?:поезд|train)\s*(?:№|#)?\s*(\d+)", text, re.I)
+    train_match = _TRAIN_RE.search(text)
     data["train_number"] = train_match.group(1) if train_match else None
 
     # вагон
-    m = re.search(r"(?:вагон|wagon)\s*(?:№|#)?\s*(\d{1,2})", text, re.I)
+    m = _WAGON_RE.search(text)
     data["wagon_number"] = m.group(1) if m else None
 
     # серийник (по умолчанию None)
     data["wagon_sn"] = None
 
     # ФИО
-    m = re.search(r"\b([А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)?)\b", text)
+    m = _NAME_RE.search(text)
     data["executor_name"] = m.group(1) if m else None
 
     # проблемы
-    probs = re.findall(
-        r"(?:проблема|не работает|сломан|отключ|пропадает|не ид[её]т)\s*[а-яёa-z0-9,\s\-]{3,}",
-        text, re.I
-    )
+    probs = _PROBLEM_RE.findall(text)
     data["problems"] = [p.strip() for p in probs] or [text[:120].strip()]
     return data
 
 
-def parse_voice_claim(text: str, tokenizer, model):
-    """parse_voice_claim – старое имя."""
-    prompt = (
-        'Извлеки данные и верни только JSON: {"train_number":"", "wagon_number":"", '
-        '"wagon_sn":"", "problems":[], "executor_name":""}\n\n'
-        '- train_number – только цифры, без букв и слов '
-        f'Текст: "{text}"\n'
-    )
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-    with torch.no_grad():
-        ids = model.generate(
-            **inputs,
-            max_new_tokens=120,
-            pad_token_id=tokenizer.eos_token_id,
-            do_sample=False,
-        )
-    response = tokenizer.decode(ids[0], skip_special_tokens=True)[len(prompt):].strip()
-
-    result = extract_first_json(response)
+# Числительные: количественные формы целиком, порядковые – основа + окончание
+_CARDINALS = {
+    "ноль": 0, "нуль": 0, "один": 1, "одна": 1, "одно": 1, "два": 2, "две": 2, "три": 3, "четыре": 4,
+    "пять": 5, "шесть": 6, "семь": 7, "восемь": 8, "девять": 9, "десять": 10, "одиннадцать": 11,
+    "двенадцать": 12, "тринадцать": 13, "четырнадцать": 14, "пятнадцать": 15, "шестнадцать": 16,
+    "семнадцать": 17, "восемнадцать": 18, "девятнадцать": 19, "двадцать": 20, "тридцать": 30, "сорок": 40,
+    "пятьдесят": 50, "шестьдесят": 60, "семьдесят": 70, "восемьдесят": 80, "девяносто": 90, "сто": 100,
+    "двести": 200, "триста": 300, "четыреста": 400, "пятьсот": 500, "шестьсот": 600, "семьсот": 700,
+    "восемьсот": 800, "девятьсот": 900,
+}
+_ORDINAL_STEMS = {
+    "перв": 1, "втор": 2, "четверт": 4, "пят": 5, "шест": 6, "седьм": 7, "восьм": 8, "девят": 9,
+    "десят": 10, "одиннадцат": 11, "двенадцат": 12, "тринадцат": 13, "четырнадцат": 14, "пятнадцат": 15,
+    "шестнадцат": 16, "семнадцат": 17, "восемнадцат": 18, "девятнадцат": 19, "двадцат": 20, "тридцат": 30,
+    "сороков": 40, "пятидесят": 50, "шестидесят": 60, "семидесят": 70, "восьмидесят": 80, "девяност": 90,
+    "сот": 100, "двухсот": 200, "трехсот": 300, "четырехсот": 400, "пятисот": 500, "шестисот": 600,
+    "семисот": 700, "восьмисот": 800, "девятисот": 900,
+}
+_ORDINAL_RE = re.compile(
+    r"^(?:(%s)(?:ый|ой|ий|ого|ому|ым|ом|ая|ую|ое|ые|ых|ыми)|(трет)(?:ий|ьего|ьему|ьим|ьем|ья|ью|ье|ьи|ьих))$"
+    % "|".join(sorted(_ORDINAL_STEMS, key=len, reverse=True))
+)
+_WORD_RE = re.compile(r"[а-яё]+|\d+|[^а-яё\d]+", re.I)
+
+
+def _numeral_value(word: str):
+    word = word.lower().replace("ё", "е")
+    if word in _CARDINALS:
+        return _CARDINALS[word]
+    m = _ORDINAL_RE.match(word)
+    if m:
+        return _ORDINAL_STEMS[m.group(1)] if m.group(1) else 3
+    return None
+
+
+def normalize_numerals(text: str) -> str:
+    """Заменяет числительные словами на цифры: «двадцать третий» → «23», «сто пять» → «105»."""
+    out, number, place = [], None, 0
+    pending_space = ""
+    for token in _WORD_RE.findall(text):
+        value = _numeral_value(token)
+        if value is not None and number is not None and value < place and not pending_space.strip():
+            number += value
+            place = 10 if value >= 10 and value % 10 == 0 and value < 100 else 1
+            pending_space = ""
+            continue
+        if token.isspace() and number is not None:
+            pending_space += token
+            continue
+        if number is not None:
+            out.append(str(number))
+            out.append(pending_space)
+            number, pending_space = None, ""
+        if value is not None:
+            number = value
+            place = 100 if value >= 100 and value % 100 == 0 else 10 if value >= 20 and value % 10 == 0 else 0
+            continue
+        out.append(token)
+    if number is not None:
+        out.append(str(number))
+        out.append(pending_space)
+    return "".join(out)
+
+
+_RULE_TRAIN_RE = re.compile(r"(?:поезд\w*|train)\s*(?:№|#|номер)?\s*(\d{1,4})\b", re.I)
+_RULE_WAGON_RE = re.compile(r"(?:вагон\w*|wagon)\s*(?:№|#|номер)?\s*(\d{1,2})\b", re.I)
+_RULE_SN_RE = re.compile(r"(?:серийн\w*\s+номер\w*|s/?n)\s*(?:№|#|:)?\s*([A-ZА-ЯЁ0-9][A-ZА-ЯЁ0-9\-]{3,})", re.I)
+_RULE_INTRO_NAME_RE = re.compile(
+    r"(?i:меня зовут|это|говорит|беспокоит|звонит)\s+([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+){0,2})"
+)
+
+
+def extract_data_with_rules(text: str):
+    """Извлечение данных правилами с оценкой уверенности по каждому полю.
+
+    Возвращает данные в формате extract_data_from_text_fallback и словарь уверенностей 0..1.
+    Номера, произнесённые словами, нормализуются в цифры, но такие совпадения получают меньшую уверенность.
+    """
+    normalized = normalize_numerals(text)
+    data, confidence = extract_data_from_text_fallback(normalized), {}
+
+    for field, pattern in (("train_number", _RULE_TRAIN_RE), ("wagon_number", _RULE_WAGON_RE)):
+        m = pattern.search(text)
+        if m:
+            data[field], confidence[field] = m.group(1), 0.95
+            continue
+        m = pattern.search(normalized)
+        if m:
+            data[field], confidence[field] = m.group(1), 0.85
+        else:
+            confidence[field] = 0.5 if data[field] else 0.0
+
+    m = _RULE_SN_RE.search(normalized)
+    data["wagon_sn"] = m.group(1) if m else None
+    confidence["wagon_sn"] = 0.9 if m else 0.0
+
+    m = _RULE_INTRO_NAME_RE.search(text)
+    if m:
+        data["executor_name"], confidence["executor_name"] = m.group(1), 0.85
+    else:
+        confidence["executor_name"] = 0.4 if data["executor_name"] else 0.0
+
+    confidence["problems"] = 0.8 if _PROBLEM_RE.search(normalized) else 0.2
+    return data, confidence
+
+
+CLAIM_FIELDS = ("train_number", "wagon_number", "wagon_sn", "problems", "executor_name")
+
+# Начало ответа подставляется в промпт: модель продолжает JSON с первого поля, а не с преамбулы
+JSON_SEED = '{"train_number": "'
+MAX_NEW_TOKENS = 120
+
+
+# Инструкция одинакова для всех вызовов, меняется только хвост с текстом. Граница – перевод строки:
+# через него BPE не склеивает токены, поэтому префикс и хвост по отдельности дают те же токены,
+# что и промпт целиком (пробел на границе склеивался бы с первым словом хвоста)
+PROMPT_PREFIX = (
+    'Извлеки данные и верни только JSON: {"train_number":"", "wagon_number":"", '
+    '"wagon_sn":"", "problems":[], "executor_name":""}\n\n'
+    '- train_number – только цифры, без букв и слов\n'
+)
+
+# Текст для проверки, что разбиение промпта на префикс и хвост не меняет токены
+_PROMPT_CHECK_TEXT = "Поезд 12, вагон 3, не работает кондиционер"
+
+
+def build_prompt_tail(text: str) -> str:
+    return f'Текст: "{text}"\n{JSON_SEED}'
+
+
+def build_prompt(text: str) -> str:
+    return PROMPT_PREFIX + build_prompt_tail(text)
+
+
+class PromptPrefixCache:
+    """past_key_values для PROMPT_PREFIX, посчитанные один раз после загрузки модели.
+
+    Каждый вызов получает копию кэша и прогоняет через модель только хвост промпта. В батче
+    строки раскладываются как ``[префикс][pad][хвост]``: префикс у всех на одних позициях,
+    паддинг хвостов закрыт attention_mask, а position_ids generate выводит из маски.
+    """
+
+    def __init__(self, tokenizer, model, prefix: str = PROMPT_PREFIX):
+        self.prefix = prefix
+        self.input_ids = tokenizer(prefix, return_tensors="pt")["input_ids"].to(model.device)
+        self._check_split(tokenizer)
+        started = time.perf_counter()
+        with torch.no_grad():
+            self.past_key_values = model(self.input_ids, use_cache=True).past_key_values
+        logger.info("✅ KV-кэш префикса промпта: %d токенов за %.2f с",
+                    self.input_ids.shape[1], time.perf_counter() - started)
+
+    def __len__(self):
+        return self.input_ids.shape[1]
+
+    def _check_split(self, tokenizer):
+        """ValueError, если префикс и хвост по отдельности токенизируются не так, как build_prompt целиком:
+        тогда модель с кэшем видела бы другие токены, чем без него."""
+        full = tokenizer(build_prompt(_PROMPT_CHECK_TEXT))["input_ids"]
+        tail = tokenizer(build_prompt_tail(_PROMPT_CHECK_TEXT), add_special_tokens=False)["input_ids"]
+        if self.input_ids[0].tolist() + list(tail) != list(full):
+            raise ValueError("токены префикса и хвоста промпта не совпадают с токенами промпта целиком")
+
+    def inputs(self, tokenizer, texts):
+        """input_ids/attention_mask полных промптов и копия кэша префикса, размноженная на батч."""
+        tails = tokenizer([build_prompt_tail(text) for text in texts], return_tensors="pt", padding=True,
+                          add_special_tokens=False).to(self.input_ids.device)
+        batch_size = len(texts)
+        prefix_ids = self.input_ids.expand(batch_size, -1)
+        past_key_values = copy.deepcopy(self.past_key_values)
+        if batch_size > 1:
+            past_key_values.batch_repeat_interleave(batch_size)
+        return {
+            "input_ids": torch.cat([prefix_ids, tails["input_ids"]], dim=1),
+            "attention_mask": torch.cat([torch.ones_like(prefix_ids), tails["attention_mask"]], dim=1),
+            "past_key_values": past_key_values,
+        }
+
+
+# Версия промпта меняется сама при любой правке шаблона или схемы – старые записи ClaimCache не подходят
+PROMPT_VERSION = hashlib.sha1(
+    "|".join((build_prompt("{text}"),) + CLAIM_FIELDS).encode("utf-8")).hexdigest()[:12]
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def normalize_transcript(text: str) -> str:
+    """Текст без различий в регистре, пунктуации и пробелах: «Поезд 12,  вагон 3.» → «поезд 12 вагон 3»."""
+    return _NON_WORD_RE.sub(" ", text.lower().replace("ё", "е")).strip()
+
+
+class ClaimCache:
+    """Кэш ответов LLM по нормализованному тексту транскрипта.
+
+    Ключ – хэш нормализованного текста, имени модели и PROMPT_VERSION. Недавние записи держатся
+    в памяти (LRU на ``memory_entries``), все – в DiskLRUCache в ``directory`` на ``max_bytes``;
+    записи старше ``ttl_seconds`` не возвращаются.
+    """
+
+    def __init__(self, directory, model_name, max_bytes, ttl_seconds, memory_entries=1024):
+        self.model_name = model_name
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._disk = DiskLRUCache(directory, max_bytes)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, text: str) -> str:
+        payload = json.dumps([normalize_transcript(text), self.model_name, PROMPT_VERSION], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _fresh(self, entry) -> bool:
+        return time.time() - entry["created"] <= self.ttl_seconds
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, text: str):
+        key = self.make_key(text)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._fresh(entry):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry["data"])
+
+        entry = self._disk.get(key, valid=self._fresh)
+        with self._lock:
+            if entry is None:
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self.hits += 1
+        return copy.deepcopy(entry["data"])
+
+    def put(self, text: str, data):
+        key = self.make_key(text)
+        entry = {"created": time.time(), "data": copy.deepcopy(data)}
+        self._disk.put(key, entry)
+        with self._lock:
+            self._remember(key, entry)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes": self._disk.size,
+                "memory_entries": len(self._memory),
+            }
+
+
+class JsonObjectStop(StoppingCriteria):
+    """Останавливает генерацию строки, как только закрыт JSON-объект, начатый JSON_SEED.
+
+    Считает глубину скобок вне строковых литералов по новым токенам каждой строки батча,
+    поэтому модель не тратит оставшиеся из MAX_NEW_TOKENS токены на текст после ``}``.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, batch_size: int):
+        self.tokenizer = tokenizer
+        self.seen = prompt_length
+        # состояние после JSON_SEED: внутри объекта и внутри строки значения
+        self.depth = [1] * batch_size
+        self.in_string = [True] * batch_size
+        self.escape = [False] * batch_size
+        self.done = [False] * batch_size
+
+    def _feed(self, row: int, chunk: str):
+        for char in chunk:
+            if self.escape[row]:
+                self.escape[row] = False
+            elif self.in_string[row]:
+                if char == "\\":
+                    self.escape[row] = True
+                elif char == '"':
+                    self.in_string[row] = False
+            elif char == '"':
+                self.in_string[row] = True
+            elif char in "{[":
+                self.depth[row] += 1
+            elif char in "}]":
+                self.depth[row] -= 1
+                if self.depth[row] == 0:
+                    self.done[row] = True
+                    return
+
+    def __call__(self, input_ids, scores, **kwargs):
+        new_ids = input_ids[:, self.seen:]
+        self.seen = input_ids.shape[1]
+        for row, ids in enumerate(new_ids.tolist()):
+            if not self.done[row]:
+                self._feed(row, self.tokenizer.decode(ids, skip_special_tokens=True))
+        return torch.tensor(self.done, dtype=torch.bool, device=input_ids.device)
+
+
+def _parse_claim_json(response: str):
+    """Ответ, начатый JSON_SEED: объект разбирается напрямую, поиск регуляркой – только для испорченного ответа."""
+    try:
+        result, _ = json.JSONDecoder().raw_decode(response)
+    except json.JSONDecodeError:
+        return extract_first_json(response)
+    return result if isinstance(result, dict) else None
+
+
+def claim_from_response(response: str, text: str):
+    """Разбирает ответ LLM в заявку; если JSON не найден – fallback на регулярках по исходному тексту.
+
+    Возвращает данные и источник: ``"llm"`` или ``"fallback"``.
+    """
+    result = _parse_claim_json(response)
     if result:
-        data = {k: result.get(k) for k in ("train_number", "wagon_number", "wagon_sn", "problems", "executor_name")}
+        data = {k: result.get(k) for k in CLAIM_FIELDS}
         data["problems"] = list(map(str, data.get("problems") or []))
         logger.info("✅ JSON из LLM получен")
-    else:
-        data = extract_data_from_text_fallback(text)
-        logger.warning("⚠️ Используем fallback")
+        return data, "llm"
+    logger.warning("⚠️ Используем fallback")
+    return extract_data_from_text_fallback(text), "fallback"
+
+
+# Поля, без уверенного значения которых заявка уходит в LLM, и порог уверенности правил
+RULES_REQUIRED_FIELDS = ("train_number", "wagon_number", "problems")
+RULES_MIN_CONFIDENCE = 0.8
+
+_stats = {"rules_only": 0, "llm_calls": 0, "cache_hits": 0, "new_tokens": 0, "generate_seconds": 0.0,
+          "target_calls": 0, "draft_calls": 0}
+
+
+CLAIMS = metrics.counter("gse_nlu_claims_total", "Извлечённые заявки по источнику: rules, cache, llm, fallback",
+                         ("source",))
+LLM_NEW_TOKENS = metrics.histogram("gse_llm_new_tokens", "Новых токенов за один generate",
+                                   buckets=(8, 16, 32, 64, 128, 256, 512, 1024))
+LLM_GENERATE_SECONDS = metrics.histogram("gse_llm_generate_seconds", "Время одного generate, с")
+LLM_TOKENS_PER_SECOND = metrics.histogram("gse_llm_tokens_per_second", "Скорость генерации одного generate, ток/с",
+                                          buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+
+def get_nlu_stats():
+    """Сколько заявок разобрано одними правилами, а сколько потребовали LLM (из них ``cache_hits`` –
+    ответ взят из ClaimCache); скорость генерации
+    и доля принятых токенов черновой модели при assisted decoding."""
+    total = _stats["rules_only"] + _stats["llm_calls"]
+    stats = dict(_stats, rules_hit_rate=_stats["rules_only"] / total if total else 0.0)
+    stats["tokens_per_second"] = (_stats["new_tokens"] / _stats["generate_seconds"]
+                                  if _stats["generate_seconds"] else 0.0)
+    if _stats["draft_calls"]:
+        stats["acceptance_rate"] = _accepted(_stats["new_tokens"], _stats["target_calls"], _stats["draft_calls"])
+    return stats
+
+
+def _accepted(new_tokens, target_calls, draft_calls):
+    # каждый проход основной модели даёт принятые токены черновика плюс один свой
+    return max(new_tokens - target_calls, 0) / draft_calls if draft_calls else 0.0
+
+
+class _CallCounter:
+    """Считает вызовы forward модели на время генерации."""
+
+    def __init__(self, model):
+        self.calls = 0
+        self._handle = model.register_forward_hook(self._hook)
+
+    def _hook(self, module, args, output):
+        self.calls += 1
+
+    def remove(self):
+        self._handle.remove()
+
+
+def _rules_complete(confidence) -> bool:
+    return all(confidence.get(field, 0.0) >= RULES_MIN_CONFIDENCE for field in RULES_REQUIRED_FIELDS)
+
+
+def _merge_rules(rules_data, confidence, llm_data, source):
+    """Уверенные значения правил приоритетнее LLM; остальные поля берутся из ответа LLM (или fallback)."""
+    data, sources = {}, {}
+    for field in CLAIM_FIELDS:
+        if rules_data.get(field) and confidence.get(field, 0.0) >= RULES_MIN_CONFIDENCE:
+            data[field], sources[field] = rules_data[field], "rules"
+        else:
+            data[field], sources[field] = llm_data.get(field), source
+    data["field_sources"] = sources
+    return data
+
+
+def _rules_claim(rules_data, confidence):
+    logger.info("✅ Данные извлечены правилами, LLM не вызывается")
+    data = {field: rules_data.get(field) for field in CLAIM_FIELDS}
+    data["field_sources"] = {field: "rules" if confidence.get(field, 0.0) >= RULES_MIN_CONFIDENCE else "fallback"
+                             for field in CLAIM_FIELDS}
+    return data
+
+
+def _generate_claim(text: str, tokenizer, model, prefix_cache=None, draft_model=None, claim_cache=None):
+    return _generate_claims([text], tokenizer, model, batch_size=1, prefix_cache=prefix_cache,
+                            draft_model=draft_model, claim_cache=claim_cache)[0]
+
+
+def _generate_claims(texts, tokenizer, model, batch_size: int, prefix_cache=None, draft_model=None,
+                     claim_cache=None):
+    """Ответы LLM для texts; найденные в ``claim_cache`` тексты не токенизируются и не генерируются."""
+    if claim_cache is None:
+        return _run_generate(texts, tokenizer, model, batch_size, prefix_cache, draft_model)
+
+    results = [None] * len(texts)
+    pending = []
+    for i, text in enumerate(texts):
+        cached = claim_cache.get(text)
+        if cached is not None:
+            _stats["cache_hits"] += 1
+            CLAIMS.inc(source="cache")
+            results[i] = (cached, "llm")
+        else:
+            pending.append(i)
+
+    generated = _run_generate([texts[i] for i in pending], tokenizer, model, batch_size, prefix_cache, draft_model)
+    for i, (data, source) in zip(pending, generated):
+        if source == "llm":  # fallback зависит от исходного текста, а не от нормализованного – не кэшируем
+            claim_cache.put(texts[i], data)
+        results[i] = (data, source)
+    return results
+
+
+def _run_generate(texts, tokenizer, model, batch_size: int, prefix_cache=None, draft_model=None):
+    if draft_model is not None:
+        # assisted decoding в transformers работает только с батчем 1; кэш префикса черновой
+        # модели не передаётся, поэтому и основная модель считает промпт целиком
+        batch_size, prefix_cache = 1, None
+    results = []
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"  # при левом паддинге новые токены всех строк начинаются с одной позиции
+    try:
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            if prefix_cache is not None:
+                inputs = prefix_cache.inputs(tokenizer, batch)
+            else:
+                inputs = tokenizer([build_prompt(text) for text in batch], return_tensors="pt",
+                                   padding=True).to(model.device)
+            prompt_length = inputs["input_ids"].shape[1]
+            stop = JsonObjectStop(tokenizer, prompt_length, len(batch))
+            counters = [_CallCounter(model), _CallCounter(draft_model)] if draft_model is not None else []
+            started = time.perf_counter()
+            try:
+                with torch.no_grad():
+                    ids = model.generate(
+                        **inputs,
+                        max_new_tokens=MAX_NEW_TOKENS,
+                        pad_token_id=tokenizer.pad_token_id,
+                        do_sample=False,
+                        stopping_criteria=StoppingCriteriaList([stop]),
+                        assistant_model=draft_model,
+                    )
+            finally:
+                for counter in counters:
+                    counter.remove()
+            _log_generation(ids[:, prompt_length:], tokenizer.pad_token_id, time.perf_counter() - started, counters)
+            # декодируем только новые токены; строки, остановленные раньше других, дополнены pad
+            responses = tokenizer.batch_decode(ids[:, prompt_length:], skip_special_tokens=True)
+            for response, text in zip(responses, batch):
+                data, source = claim_from_response(JSON_SEED + response.strip(), text)
+                CLAIMS.inc(source=source)
+                results.append((data, source))
+    finally:
+        tokenizer.padding_side = padding_side
+    return results
+
+
+def _log_generation(new_ids, pad_token_id, seconds, counters):
+    new_tokens = int((new_ids != pad_token_id).sum())
+    _stats["new_tokens"] += new_tokens
+    _stats["generate_seconds"] += seconds
+    LLM_NEW_TOKENS.observe(new_tokens)
+    LLM_GENERATE_SECONDS.observe(seconds)
+    if seconds:
+        LLM_TOKENS_PER_SECOND.observe(new_tokens / seconds)
+    message = f"LLM: {new_tokens} токенов за {seconds:.2f} с ({new_tokens / seconds if seconds else 0.0:.1f} ток/с)"
+    if counters:
+        target_calls, draft_calls = counters[0].calls, counters[1].calls
+        _stats["target_calls"] += target_calls
+        _stats["draft_calls"] += draft_calls
+        message += f", принято токенов черновика: {_accepted(new_tokens, target_calls, draft_calls):.0%}"
+    logger.info(message)
+
+
+def parse_voice_claim(text: str, tokenizer, model, prefix_cache=None, draft_model=None, claim_cache=None):
+    """parse_voice_claim – старое имя.
+
+    Сначала данные извлекаются правилами; если обязательные поля найдены уверенно, LLM не вызывается.
+    Источник каждого поля – в ``data["field_sources"]``. С ``prefix_cache`` (PromptPrefixCache)
+    инструкция промпта не прогоняется через модель повторно. С ``draft_model`` (load_draft_model)
+    генерация идёт через assisted decoding; при жадном декодировании ответ тот же. С ``claim_cache``
+    (ClaimCache) повторный текст не отправляется в LLM.
+    """
+    rules_data, confidence = extract_data_with_rules(text)
+    if _rules_complete(confidence):
+        _stats["rules_only"] += 1
+        CLAIMS.inc(source="rules")
+        return _rules_claim(rules_data, confidence)
+
+    _stats["llm_calls"] += 1
+    llm_data, source = _generate_claim(text, tokenizer, model, prefix_cache, draft_model, claim_cache)
+    return _merge_rules(rules_data, confidence, llm_data, source)
+
+
+def parse_voice_claims(texts, tokenizer, model, batch_size: int = 8, prefix_cache=None, draft_model=None,
+                       claim_cache=None):
+    """Пакетная версия parse_voice_claim: в LLM уходят только тексты, которые правила не разобрали уверенно,
+    одним generate на batch_size текстов; результаты – в порядке texts."""
+    results = [None] * len(texts)
+    pending = []
+    for i, text in enumerate(texts):
+        rules_data, confidence = extract_data_with_rules(text)
+        if _rules_complete(confidence):
+            _stats["rules_only"] += 1
+            CLAIMS.inc(source="rules")
+            results[i] = _rules_claim(rules_data, confidence)
+        else:
+            pending.append((i, rules_data, confidence))
 
-    return data
\ No newline at end of file
+    if pending:
+        _stats["llm_calls"] += len(pending)
+        generated = _generate_claims([texts[i] for i, _, _ in pending], tokenizer, model, batch_size,
+                                     prefix_cache, draft_model, claim_cache)
+        for (i, rules_data, confidence), (llm_data, source) in zip(pending, generated):
+            results[i] = _merge_rules(rules_data, confidence, llm_data, source)
+    return results
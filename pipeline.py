@@ -0,0 +1,154 @@
+import logging
+import queue
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = metrics.histogram("gse_pipeline_stage_seconds", "Время одного вызова этапа (файл или батч), с",
+                                  ("stage",))
+STAGE_ITEMS = metrics.counter("gse_pipeline_items_total", "Файлы, обработанные этапом", ("stage", "result"))
+QUEUE_DEPTH = metrics.gauge("gse_pipeline_queue_depth", "Файлов во входной очереди этапа", ("stage",))
+
+_DONE = object()
+
+
+class Stage:
+    """Этап конвейера: ``workers`` потоков берут элементы из входной очереди размером ``queue_size``
+    и передают результат ``fn`` следующему этапу.
+
+    ``fn`` получает элемент и возвращает элемент для следующего этапа или ``None``, если элемент
+    дальше не идёт. С ``batch_size`` ``fn`` получает список из накопившихся в очереди элементов
+    (не больше ``batch_size``) и возвращает список той же длины; батч собирается из того, что уже
+    лежит в очереди, или, с ``max_wait``, ждёт новые элементы до ``max_wait`` секунд после первого.
+    Исключение в ``fn`` логируется, элемент (или весь батч) отбрасывается.
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=8, batch_size=None, max_wait=0.0):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=max(queue_size, batch_size or 1))
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        self.queue.put(item)
+        QUEUE_DEPTH.set(self.queue.qsize(), stage=self.name)
+
+    def _take(self):
+        """Блокируется до первого элемента, затем добирает батч до batch_size или истечения max_wait."""
+        first = self.queue.get()
+        QUEUE_DEPTH.set(self.queue.qsize(), stage=self.name)
+        if first is _DONE or self.batch_size is None:
+            return first, []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                self.queue.put(_DONE)  # вернём для остальных воркеров этапа
+                break
+            batch.append(item)
+        QUEUE_DEPTH.set(self.queue.qsize(), stage=self.name)
+        return None, batch
+
+    def _call(self, items):
+        started = time.perf_counter()
+        try:
+            if self.batch_size is None:
+                results = [self.fn(items[0])]
+            else:
+                results = self.fn(items)
+            failed = 0
+        except Exception as e:
+            logger.exception(f"Pipeline stage {self.name} failed on {len(items)} item(s): {e}")
+            results, failed = [], len(items)
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=self.name)
+        STAGE_ITEMS.inc(len(items) - failed, stage=self.name, result="ok")
+        if failed:
+            STAGE_ITEMS.inc(failed, stage=self.name, result="failed")
+        with self._lock:
+            self.busy_seconds += elapsed
+            self.processed += len(items) - failed
+            self.failed += failed
+        return [result for result in results if result is not None]
+
+    def stats(self):
+        with self._lock:
+            return {"processed": self.processed, "failed": self.failed, "busy_seconds": self.busy_seconds,
+                    "workers": self.workers}
+
+
+class Pipeline:
+    """Этапы, соединённые ограниченными очередями: пока один этап ждёт сеть, другие заняты CPU.
+
+    Заполненная очередь блокирует предыдущий этап (back-pressure), поэтому, например, загрузка
+    не уходит далеко вперёд распознавания. Пропускная способность упирается в самый медленный этап,
+    а не в сумму всех.
+
+    .. code::
+
+        >>> pipeline = Pipeline([Stage("fetch", download, workers=2), Stage("asr", transcribe)])
+        >>> pipeline.run(filenames)
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item, batch = stage._take()
+            if item is _DONE:
+                stage.queue.put(_DONE)  # остальные воркеры этапа тоже должны завершиться
+                return
+            for result in stage._call(batch or [item]):
+                if next_stage is not None:
+                    next_stage.put(result)
+
+    def _close_stage(self, index, threads):
+        for thread in threads:
+            thread.join()
+        if index + 1 < len(self.stages):
+            self.stages[index + 1].queue.put(_DONE)
+
+    def run(self, items):
+        """Прогоняет items через все этапы и ждёт завершения; возвращает статистику этапов."""
+        started = time.perf_counter()
+        closers = []
+        for index, stage in enumerate(self.stages):
+            threads = [threading.Thread(target=self._worker, args=(index,), name=f"{stage.name}-{n}", daemon=True)
+                       for n in range(stage.workers)]
+            for thread in threads:
+                thread.start()
+            # этап закрывается, когда все его воркеры закончили, – тогда завершаем следующий
+            closer = threading.Thread(target=self._close_stage, args=(index, threads), daemon=True)
+            closer.start()
+            closers.append(closer)
+
+        first = self.stages[0]
+        for item in items:
+            first.put(item)
+        first.queue.put(_DONE)
+        for closer in closers:
+            closer.join()
+
+        stats = {stage.name: stage.stats() for stage in self.stages}
+        elapsed = time.perf_counter() - started
+        logger.info(f"Pipeline finished in {elapsed:.1f} s: " + ", ".join(
+            f"{name} {s['processed']} ok/{s['failed']} failed/{s['busy_seconds']:.1f} s busy"
+            for name, s in stats.items()))
+        return stats
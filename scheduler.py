@@ -2,6 +2,9 @@ import logging
 
 import schedule
 import time
+import metrics
+from config import INFERENCE_DAEMON_ENABLED, METRICS_PORT
+from inference_client import InferenceClient, InferenceError
 from sftp_handler import SFTPAudioProcessor
 from logger import setup_logger
 
@@ -9,10 +12,36 @@ setup_logger()
 logger = logging.getLogger(__name__)
 
 
+def daemon_snapshot():
+    """Метрики сервиса инференса или None, если он выключен или не отвечает."""
+    if not INFERENCE_DAEMON_ENABLED:
+        return None
+    client = InferenceClient()
+    try:
+        return client.metrics_snapshot()
+    except InferenceError as e:
+        logger.debug(f"Inference daemon metrics not available: {e}")
+        return None
+    finally:
+        client.close()
+
+
 def processing_job():
     logger.info("=== Starting audio files processing ===")
-    processor = SFTPAudioProcessor()
-    processor.process_new_files()
+    since, daemon_since = metrics.snapshot(), daemon_snapshot()
+    started = time.time()
+    try:
+        processor = SFTPAudioProcessor()
+        processor.process_new_files()
+    finally:
+        # сводка метрик именно этого запуска: счётчики и гистограммы – прирост с его начала;
+        # распознавание и LLM в сервисе инференса – отдельным разделом по его метрикам
+        extra = {}
+        daemon_after = daemon_snapshot() if daemon_since is not None else None
+        if daemon_after is not None:
+            extra["inference_daemon"] = metrics.summarize(daemon_since, daemon_after)
+        path = metrics.write_summary(since, duration_seconds=round(time.time() - started, 1), **extra)
+        logger.info(f"Metrics summary saved to {path}")
     logger.info("=== Processing completed ===\n")
 
 
@@ -21,6 +50,8 @@ schedule.every().day.at("04:00").do(processing_job)  # Основная ночн
 
 if __name__ == "__main__":
     logger.info("Audio processing service started")
+    if METRICS_PORT:
+        metrics.MetricsServer().start()
     try:
         while True:
             schedule.run_pending()
@@ -1,54 +1,73 @@
 import paramiko
 import os
+import threading
+import time
 from datetime import datetime
 import logging
 from config import *
 from logger import setup_logger
+from glpi_session import GLPISessionManager
+from job_store import open_store, stage_reached
+import metrics
+from pipeline import Pipeline, Stage
+from tickets import create_tickets
 
 setup_logger()
 logger = logging.getLogger(__name__)
 
+SFTP_SECONDS = metrics.histogram("gse_sftp_seconds", "Операции SFTP, с", ("op",))
+FILES_PENDING = metrics.gauge("gse_files_pending", "Необработанных файлов на SFTP при последней проверке")
+ERRORS = metrics.counter("gse_errors_total", "Ошибки обработки файлов по этапам", ("stage",))
+
 
 class SFTPAudioProcessor:
     def __init__(self):
         self.ssh = paramiko.SSHClient()
         self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         self.sftp = None
-        self.processed_files = self.load_processed_files()
+        self.inference = None
+        self.local_models = False
+        self.glpi = None
+        self.jobs = open_store()
+        self._local = threading.local()
+        self._channels = []
+        self._lock = threading.Lock()
 
     def connect(self):
         try:
             self.ssh.connect(SFTP_HOST, port=SFTP_PORT,
                              username=SFTP_USER, password=SFTP_PASSWORD)
             self.sftp = self.ssh.open_sftp()
+            self._local.sftp = self.sftp
             logger.info("SFTP connection established")
             return True
         except Exception as e:
             logger.error(f"SFTP connection error: {e}")
             return False
 
-    def load_processed_files(self):
-        try:
-            with open(PROCESSED_FILES_LOG, 'r') as f:
-                return {line.strip() for line in f if line.strip()}
-        except FileNotFoundError:
-            return set()
-
-    def save_processed_file(self, filename):
-        with open(PROCESSED_FILES_LOG, 'a') as f:
-            f.write(f"{filename}\n")
-        self.processed_files.add(filename)
+    def _channel(self):
+        """SFTP-канал текущего потока: этапы конвейера работают с SFTP параллельно,
+        а один SFTPClient paramiko не рассчитан на использование из нескольких потоков."""
+        sftp = getattr(self._local, "sftp", None)
+        if sftp is None:
+            sftp = self._local.sftp = self.ssh.open_sftp()
+            with self._lock:
+                self._channels.append(sftp)
+        return sftp
 
     # В методе get_new_audio_files добавьте проверку на наличие соответствующих txt файлов
     def get_new_audio_files(self):
         try:
-            files = self.sftp.listdir(SFTP_REMOTE_PATH)
+            with SFTP_SECONDS.time(op="list"):
+                files = self.sftp.listdir(SFTP_REMOTE_PATH)
             wav_files = [f for f in files
                          if f.startswith('msg')
                          and f.endswith('.wav')
-                         and f not in self.processed_files
                          and f.replace('.wav', '.txt') in files]  # Проверяем наличие txt файла
-            return sorted(wav_files)
+            finished = self.jobs.finished(wav_files)
+            new_files = sorted(f for f in wav_files if f not in finished)
+            FILES_PENDING.set(len(new_files))
+            return new_files
         except Exception as e:
             logger.error(f"Error listing files: {e}")
             return []
@@ -57,7 +76,7 @@ class SFTPAudioProcessor:
     def read_metadata_file(self, filename):
         txt_filename = filename.replace('.wav', '.txt')
         try:
-            with self.sftp.open(f"{SFTP_REMOTE_PATH}/{txt_filename}") as f:
+            with SFTP_SECONDS.time(op="metadata"), self._channel().open(f"{SFTP_REMOTE_PATH}/{txt_filename}") as f:
                 content = f.read().decode('utf-8')
                 metadata = {}
                 for line in content.splitlines():
@@ -75,7 +94,8 @@ class SFTPAudioProcessor:
         try:
             os.makedirs(LOCAL_DOWNLOAD_PATH, exist_ok=True)
             remote_path = f"{SFTP_REMOTE_PATH}/{filename}"
-            self.sftp.get(remote_path, local_path)
+            with SFTP_SECONDS.time(op="download"):
+                self._channel().get(remote_path, local_path)
             logger.info(f"Downloaded: {filename}")
             return local_path
         except Exception as e:
@@ -85,26 +105,50 @@ class SFTPAudioProcessor:
     def archive_processed_file(self, filename):
         try:
             archive_dir = f"{SFTP_REMOTE_PATH}/{ARCHIVE_DIR}"
-            try:
-                self.sftp.mkdir(archive_dir)
-            except IOError:
-                pass  # Директория уже существует
-
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            new_name = f"{timestamp}_{filename}"
-            self.sftp.rename(f"{SFTP_REMOTE_PATH}/{filename}",
-                             f"{archive_dir}/{new_name}")
+            sftp = self._channel()
+            with SFTP_SECONDS.time(op="archive"):
+                try:
+                    sftp.mkdir(archive_dir)
+                except IOError:
+                    pass  # Директория уже существует
+
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                new_name = f"{timestamp}_{filename}"
+                sftp.rename(f"{SFTP_REMOTE_PATH}/{filename}",
+                            f"{archive_dir}/{new_name}")
             logger.info(f"Archived: {filename} -> {archive_dir}/{new_name}")
             return True
         except Exception as e:
             logger.error(f"Archive failed for {filename}: {e}")
             return False
 
-    def process_new_files(self):
-        if not self.connect():
-            return
+    def _backend(self):
+        """Функции распознавания (пути -> тексты) и извлечения (тексты -> данные заявок) и размер батча ASR:
+        сервис инференса, если он запущен, иначе модели загружаются в этом процессе (один раз на весь прогон)."""
+        if INFERENCE_DAEMON_ENABLED:
+            from inference_client import InferenceClient
+            client = InferenceClient()
+            if client.available():
+                logger.info(f"Using inference daemon at {client.url}")
+                self.inference = client
+                return client.transcribe, client.extract, ASR_BATCH_FILES
+            client.close()
+
+        logger.info("Inference daemon not used, loading models in-process")
+        from main import extract_batch, get_asr_settings, init_models, start_asr_pool, transcribe_paths
+        self.local_models = True
+        pool = start_asr_pool()
+        init_models(warm_asr=pool is None)
+        batched = pool is not None or (ASR_BATCH_SIZE > 1 and not ASR_CASCADE_ENABLED)
+        # поштучно файлы распознаются параллельно на репликах модели – по одному на реплику
+        return transcribe_paths, extract_batch, ASR_BATCH_FILES if batched else get_asr_settings()["replicas"] or 1
 
+    def process_new_files(self):
         try:
+            # соединение и JobStore закрываются в finally и тогда, когда подключиться не удалось
+            if not self.connect():
+                return
+
             new_files = self.get_new_audio_files()
             if not new_files:
                 logger.info("No new audio files to process")
@@ -112,28 +156,141 @@ class SFTPAudioProcessor:
 
             logger.info(f"Found {len(new_files)} new audio files")
 
-            for filename in new_files:
-                # Читаем метаданные из txt файла
-                metadata = self.read_metadata_file(filename)
-                if not metadata:
-                    logger.warning(f"No metadata found for {filename}, skipping")
-                    continue
-
-                local_file = self.download_audio_file(filename)
-                if local_file:
-                    try:
-                        from main import process_audio_file
-                        if process_audio_file(local_file, metadata):
-                            self.save_processed_file(filename)
-                            self.archive_processed_file(filename)
-                            os.remove(local_file)  # Удаляем локальную копию
-                    except Exception as e:
-                        logger.error(f"Processing failed for {filename}: {e}")
+            transcribe, extract, asr_batch = self._backend()
+            self.glpi = GLPISessionManager(pool_size=max(GLPI_POOL_SIZE, PIPELINE_GLPI_WORKERS))
+            pipeline = Pipeline([
+                Stage("fetch", self._fetch, PIPELINE_FETCH_WORKERS, PIPELINE_QUEUE_SIZE),
+                Stage("asr", lambda items: self._transcribe(items, transcribe), PIPELINE_ASR_WORKERS,
+                      PIPELINE_QUEUE_SIZE, batch_size=asr_batch),
+                Stage("nlu", lambda items: self._extract(items, extract), PIPELINE_NLU_WORKERS,
+                      PIPELINE_QUEUE_SIZE, batch_size=LLM_BATCH_SIZE),
+                Stage("glpi", self._submit, PIPELINE_GLPI_WORKERS, PIPELINE_QUEUE_SIZE,
+                      batch_size=GLPI_BULK_SIZE, max_wait=GLPI_BULK_SECONDS),
+                Stage("archive", self._archive, PIPELINE_ARCHIVE_WORKERS, PIPELINE_QUEUE_SIZE),
+            ])
+            pipeline.run(new_files)
         finally:
+            if self.glpi:
+                self.glpi.close()
+                self.glpi = None
+            if self.inference:
+                self.inference.close()
+                self.inference = None
+            if self.local_models:
+                from main import stop_asr_pool
+                stop_asr_pool()
+                self.local_models = False
             self.close()
 
+    # Этапы конвейера: каждый получает и возвращает словарь с данными файла. Результаты этапов
+    # сохраняются в JobStore, поэтому повторный запуск пропускает уже пройденные этапы файла
+
+    def _fetch(self, filename):
+        job = self.jobs.get(filename)
+        # Читаем метаданные из txt файла (если они не сохранены с прошлой попытки)
+        metadata = job["metadata"] if job and job["metadata"] else self.read_metadata_file(filename)
+        if not metadata:
+            logger.warning(f"No metadata found for {filename}, skipping")
+            ERRORS.inc(stage="metadata")
+            return None
+
+        job = self.jobs.start(filename, metadata)
+        item = {
+            "filename": filename,
+            "metadata": metadata,
+            "local_file": None,
+            "text": job["transcript"] if stage_reached(job, "transcribed") else None,
+            "claim": job["claim"] if stage_reached(job, "extracted") else None,
+            "ticket_id": job["ticket_id"] if stage_reached(job, "submitted") else None,
+        }
+        if item["text"] is not None:
+            logger.info(f"Resuming {filename} after stage '{job['stage']}' (attempt {job['attempts']})")
+            return item
+
+        started = time.perf_counter()
+        local_file = self.download_audio_file(filename)
+        if not local_file:
+            self._fail(filename, "fetch", "download failed")
+            return None
+        self.jobs.checkpoint(filename, "new", time.perf_counter() - started, step="fetch")
+        item["local_file"] = os.path.abspath(local_file)
+        return item
+
+    def _fail(self, filename, stage, error):
+        ERRORS.inc(stage=stage)
+        self.jobs.fail(filename, stage, error)
+
+    def _run_step(self, step, items, fn):
+        """Вызывает fn для items; при ошибке отмечает её у всех items и пробрасывает дальше.
+        Возвращает результат fn и время на один элемент."""
+        started = time.perf_counter()
+        try:
+            results = fn(items)
+        except Exception as e:
+            for item in items:
+                self._fail(item["filename"], step, e)
+            raise
+        return results, (time.perf_counter() - started) / len(items)
+
+    def _transcribe(self, items, transcribe):
+        todo = [item for item in items if item["text"] is None]
+        if todo:
+            try:
+                texts, seconds = self._run_step("asr", todo, lambda batch: transcribe(
+                    [item["local_file"] for item in batch]))
+            finally:
+                for item in todo:
+                    if os.path.exists(item["local_file"]):
+                        os.remove(item["local_file"])  # Удаляем локальную копию
+            for item, text in zip(todo, texts):
+                if not text:
+                    logger.error(f"No text recognized from {item['filename']}")
+                    self._fail(item["filename"], "asr", "no text recognized")
+                    continue
+                item["text"] = text
+                self.jobs.checkpoint(item["filename"], "transcribed", seconds, step="asr", transcript=text)
+        return [item if item["text"] else None for item in items]
+
+    def _extract(self, items, extract):
+        todo = [item for item in items if item["claim"] is None]
+        if todo:
+            claims, seconds = self._run_step("nlu", todo, lambda batch: extract([item["text"] for item in batch]))
+            for item, claim in zip(todo, claims):
+                item["claim"] = claim
+                self.jobs.checkpoint(item["filename"], "extracted", seconds, step="nlu", claim=claim)
+        return items
+
+    def _submit(self, items):
+        # Заявки уходят пачкой; не созданные не архивируются и будут отправлены в следующий запуск
+        todo = [item for item in items if item["ticket_id"] is None]
+        if todo:
+            outcomes, seconds = self._run_step("glpi", todo, lambda batch: create_tickets(
+                [(item["claim"], item["metadata"]) for item in batch], self.glpi))
+            for item, (ticket_id, error) in zip(todo, outcomes):
+                if ticket_id:
+                    item["ticket_id"] = ticket_id
+                    logger.info(f"Ticket #{ticket_id} created for {item['filename']}")
+                    self.jobs.checkpoint(item["filename"], "submitted", seconds, step="glpi", ticket_id=ticket_id)
+                else:
+                    logger.error(f"Ticket creation failed for {item['filename']}: {error}")
+                    self._fail(item["filename"], "glpi", error)
+        return [item if item["ticket_id"] else None for item in items]
+
+    def _archive(self, item):
+        started = time.perf_counter()
+        if self.archive_processed_file(item["filename"]):
+            self.jobs.checkpoint(item["filename"], "archived", time.perf_counter() - started, step="archive")
+        else:
+            # заявка уже создана – следующий запуск только повторит архивирование
+            self._fail(item["filename"], "archive", "archive failed")
+        return item
+
     def close(self):
+        for sftp in self._channels:
+            sftp.close()
+        self._channels = []
         if self.sftp:
             self.sftp.close()
         self.ssh.close()
+        self.jobs.close()
         logger.info("SFTP connection closed")
\ No newline at end of file
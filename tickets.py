@@ -0,0 +1,95 @@
+import logging
+from datetime import datetime
+
+from config import GLPI_APP_TOKEN, GLPI_URL, GLPI_USER_TOKEN
+from glpi_api import GLPIError, connect
+
+logger = logging.getLogger(__name__)
+
+
+def generate_ticket_content(claim_data):
+    """Генерация содержимого заявки"""
+    return (
+        "Заявка создана через голосового помощника\n"
+        "#голосовой_помощник\n"
+        f"Поезд: {claim_data.get('train_number', 'N/A')}\n"
+        f"Вагон: {claim_data.get('wagon_number', 'N/A')}\n"
+        f"Серийный номер: {claim_data.get('wagon_sn', 'N/A')}\n"
+        f"Проблемы: {', '.join(claim_data.get('problems', []))}\n"
+        f"Заявитель: {claim_data.get('executor_name', 'аноним')}\n"
+        f"Номер звонящего: {claim_data.get('callerid', 'N/A')}\n"
+        f"Дата звонка: {claim_data.get('call_date', 'N/A')}"
+    )
+
+
+def add_metadata(claim_data, metadata):
+    """Добавляем метаданные из txt файла в claim_data"""
+    if metadata:
+        claim_data.update({
+            'callerid': metadata.get('callerid', 'N/A'),
+            'origtime': metadata.get('origtime', 0),
+            'call_date': datetime.fromtimestamp(metadata.get('origtime', 0)).strftime('%Y-%m-%d %H:%M:%S')
+        })
+    return claim_data
+
+
+def build_ticket(claim_data):
+    """Поля заявки GLPI для извлечённых данных."""
+    return {
+        "name": f"Заявка от {claim_data.get('executor_name', 'анонима')}",
+        "content": generate_ticket_content(claim_data),
+        "urgency": 4,
+        "impact": 4,
+        "priority": 4,
+        "type": 1,
+        "requesttypes_id": 8,
+        "itilcategories_id": 39,
+        "entities_id": 16,
+        "_users_id_observer": [22],
+    }
+
+
+def create_ticket(claim_data, metadata=None, glpi=None):
+    """Создаёт заявку в GLPI и возвращает её id. Модели здесь не нужны – модуль не импортирует torch.
+
+    ``glpi`` – общая сессия (GLPISessionManager) на весь прогон; без неё сессия открывается
+    и закрывается ради одной заявки.
+    """
+    add_metadata(claim_data, metadata)
+    if glpi is None:
+        with connect(GLPI_URL, GLPI_APP_TOKEN, GLPI_USER_TOKEN) as glpi:
+            result = glpi.add("Ticket", build_ticket(claim_data))
+    else:
+        result = glpi.add("Ticket", build_ticket(claim_data))
+    ticket_id = result[0]['id']
+    logger.info(f"Ticket #{ticket_id} created successfully")
+    return ticket_id
+
+
+def create_tickets(entries, glpi):
+    """Создаёт заявки для ``entries`` – списка (claim_data, metadata) – одним add("Ticket", ...).
+
+    Возвращает для каждой записи, в порядке entries, пару (id заявки, ошибка): при частичном успехе
+    (HTTP 207) GLPI возвращает ``id: false`` и сообщение для не созданных заявок, при ошибке всего
+    запроса не создана ни одна.
+    """
+    if not entries:
+        return []
+    tickets = [build_ticket(add_metadata(claim_data, metadata)) for claim_data, metadata in entries]
+    try:
+        results = glpi.add("Ticket", *tickets)
+    except GLPIError as e:
+        logger.error(f"Bulk ticket creation failed for {len(tickets)} tickets: {e}")
+        return [(None, str(e))] * len(tickets)
+
+    outcomes = []
+    for i in range(len(tickets)):
+        result = results[i] if i < len(results) else {}
+        if isinstance(result, dict) and result.get('id'):
+            outcomes.append((result['id'], None))
+        else:
+            message = result.get('message') if isinstance(result, dict) else None
+            outcomes.append((None, message or "no id returned"))
+    created = sum(1 for ticket_id, _ in outcomes if ticket_id)
+    logger.info(f"Bulk ticket creation: {created} of {len(tickets)} tickets created")
+    return outcomes
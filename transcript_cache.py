@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class DiskLRUCache:
+    """Дисковый кэш JSON-значений по строковому ключу.
+
+    Записи хранятся JSON-файлами в ``directory`` и пишутся атомарно; при превышении ``max_bytes``
+    удаляются давно не использованные (по времени последнего чтения).
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path, _ in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        yield path, os.path.getmtime(path)
+                    except OSError:
+                        continue
+
+    def get(self, key, valid=None):
+        """Значение по ключу или None; запись, для которой ``valid(value)`` ложно, считается промахом."""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            if valid is not None and not valid(value):
+                raise ValueError(f"stale entry {key}")
+            os.utime(path)  # отмечаем использование для LRU
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._size += os.path.getsize(path) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        for path, _ in sorted(self._entries(), key=lambda entry: entry[1]):
+            if self._size <= self.max_bytes:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._size -= size
+            except OSError as e:
+                logger.error(f"Не удалось удалить запись кэша {path}: {e}")
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes": self._size,
+            }
+
+
+class TranscriptCache(DiskLRUCache):
+    """Дисковый кэш результатов распознавания.
+
+    Ключ – хэш содержимого аудио вместе с моделью и параметрами декодирования, поэтому повторная
+    обработка того же файла (например, после ошибки GLPI) не запускает Whisper.
+    """
+
+    @staticmethod
+    def make_key(file_path, **settings):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+        return digest.hexdigest()